@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+
+
+def open_annotations(fname):
+    """Opens an annotation file, gzip-compressed or not
+    Args:
+    fname (str):  annotation file name
+
+    Returns:
+    f     (file): text file object
+    """
+
+    with open(fname, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+
+    if compressed:
+        return gzip.open(fname, 'rt', encoding='utf-8')
+
+    return open(fname, 'r', encoding='utf-8')
+
+
+class _JSONStream:
+    """Incremental reader of the JSON values of a text file, buffered by chunks
+
+    Args:
+    f          (file): text file object
+    chunk_size (int):  minimum number of characters read at once
+    """
+
+    _decoder = json.JSONDecoder()
+    _whitespace = ' \t\n\r'
+    _number_chars = '.eE+-0123456789'
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        # drop consumed characters, and read at least as much as already buffered
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+
+        data = self._file.read(max(self._chunk_size, len(self._buf)))
+        if not data:
+            self._eof = True
+        self._buf += data
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end of the file)"""
+
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buf) or self._eof:
+                return self._buf[self._pos:self._pos+1]
+            self._fill()
+
+    def expect(self, char):
+        """Consumes the next non-whitespace character, which must be char"""
+
+        if self.peek() != char:
+            raise ValueError('Malformed annotation file: expected {!r} at {!r}'.format(char, self._buf[self._pos:self._pos+20]))
+        self._pos += 1
+
+    def next_item(self, closing):
+        """Consumes the separator before the next item of an object or array; False if closed instead"""
+
+        char = self.peek()
+        if char == closing:
+            self._pos += 1
+            return False
+        if char == ',':
+            self._pos += 1
+
+        return True
+
+    def value(self):
+        """Decodes the next JSON value"""
+
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # a number may continue past the end of the buffer, even if cut after its integer part or exponent mark
+                truncated = (isinstance(value, (int, float)) and not isinstance(value, bool)
+                             and (end == len(self._buf) or self._buf[end] in self._number_chars))
+                if self._eof or (end < len(self._buf) and not truncated):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def _iter_object(stream):
+    """Iterates over the keys of a JSON object, the value of each key remaining to be consumed"""
+
+    stream.expect('{')
+    while stream.next_item('}'):
+        key = stream.value()
+        stream.expect(':')
+        yield key
+
+
+def _iter_array(stream):
+    """Iterates over the items of a JSON array, each item remaining to be consumed"""
+
+    stream.expect('[')
+    i = 0
+    while stream.next_item(']'):
+        yield i
+        i += 1
+
+
+def iter_episodes(fname):
+    """Iterates over the episodes of an annotation file, one at a time, without loading the whole file
+    Args:
+    fname       (str):  annotation file name (possibly gzip-compressed)
+
+    Yields:
+    season_idx  (int):  season index
+    episode_idx (int):  episode index within the season
+    episode     (dict): episode annotations
+    """
+
+    with open_annotations(fname) as f:
+        stream = _JSONStream(f)
+
+        for key in _iter_object(stream):
+            if key != 'seasons':
+                stream.value()
+                continue
+
+            for season_idx in _iter_array(stream):
+                for season_key in _iter_object(stream):
+                    if season_key != 'episodes':
+                        stream.value()
+                        continue
+
+                    for episode_idx in _iter_array(stream):
+                        yield season_idx, episode_idx, stream.value()
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import json
+import os
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def read_manifest(manifest_fname, output_dir=None, output_format='npz'):
+    """Reads the series to process from a manifest file
+
+    The manifest is a JSON list with one item per series: either the path of its annotation file,
+    or an object with an "input_annot_fname" key, and optionally "output_graph_fname",
+    "output_binary_fname" and any other keyword argument of gen_dynamic_network. Relative paths
+    are relative to the directory of the manifest. Series without output file are written out to
+    output_dir, named after their annotation file.
+
+    Args:
+    manifest_fname (str):  manifest file name (.json)
+    output_dir     (str):  default output directory (required for series without output file)
+    output_format  (str):  format of the default output files: 'graphml', 'graphml.gz', 'npz', 'parquet' or 'npy'
+
+    Returns:
+    series         (list): keyword arguments of gen_dynamic_network for every series
+    """
+
+    with open(manifest_fname, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(manifest_fname))
+    resolve = lambda path: os.path.join(root, os.path.expanduser(path))
+
+    series = []
+    for item in manifest:
+        kwargs = dict(item) if isinstance(item, dict) else {'input_annot_fname': item}
+
+        for key in ('input_annot_fname', 'output_graph_fname', 'output_binary_fname', 'state_fname', 'cache_dir'):
+            if kwargs.get(key) is not None:
+                kwargs[key] = resolve(kwargs[key])
+
+        if kwargs.get('output_graph_fname') is None and kwargs.get('output_binary_fname') is None:
+            if output_dir is None:
+                raise ValueError('No output file for {}, and no output directory'.format(kwargs['input_annot_fname']))
+
+            name = os.path.basename(kwargs['input_annot_fname']).split('.')[0]
+            path = os.path.join(os.path.expanduser(output_dir), '{}.{}'.format(name, output_format))
+            kwargs['output_graph_fname' if output_format.startswith('graphml') else 'output_binary_fname'] = path
+
+        series.append(kwargs)
+
+    return series
+
+
+def _init_worker():
+    """Imports the processing modules once per worker process, to be reused by every series it processes"""
+
+    import gen_dynamic_network
+
+
+def _process_series(kwargs, trace_memory=False):
+    """Generates the dynamic network of one series, in a worker process
+    Args:
+    kwargs       (dict): keyword arguments of gen_dynamic_network
+    trace_memory (bool): record the peak memory of every stage
+
+    Returns:
+    summary      (dict): input and output files, status, wall time, and profiling report (see profiling.Profiler)
+    """
+
+    import gen_dynamic_network
+    from profiling import Profiler
+
+    summary = {'input_annot_fname': kwargs['input_annot_fname'],
+               'output_graph_fname': kwargs.get('output_graph_fname'),
+               'output_binary_fname': kwargs.get('output_binary_fname')}
+
+    for path in (summary['output_graph_fname'], summary['output_binary_fname']):
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # compact networks are written out to graphml without networkx
+    kwargs = dict({'compact': True}, **kwargs)
+
+    profiler = Profiler(trace_memory=trace_memory)
+    start = time.perf_counter()
+    try:
+        gen_dynamic_network.gen_dynamic_network(profiler=profiler, **kwargs)
+        summary['status'] = 'ok'
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+    summary['wall_time'] = time.perf_counter() - start
+    summary['profile'] = profiler.report()
+
+    return summary
+
+
+def run_batch(series, workers=1, trace_memory=False):
+    """Generates the dynamic network of several series concurrently
+
+    Series are scheduled largest annotation file first, to balance the load of the workers.
+
+    Args:
+    series       (list): keyword arguments of gen_dynamic_network for every series (see read_manifest)
+    workers      (int):  number of worker processes, each processing one series at a time
+    trace_memory (bool): record the peak memory of every stage
+
+    Returns:
+    summaries    (list): summary of every series (see _process_series), in the order of the manifest
+    """
+
+    sizes = [os.path.getsize(kwargs['input_annot_fname']) if os.path.exists(kwargs['input_annot_fname']) else 0
+             for kwargs in series]
+    order = sorted(range(len(series)), key=lambda i: -sizes[i])
+
+    summaries = [None] * len(series)
+    with ProcessPoolExecutor(max(1, workers), initializer=_init_worker) as executor:
+        futures = {executor.submit(_process_series, series[i], trace_memory): i for i in order}
+        for future in as_completed(futures):
+            i = futures[future]
+            summaries[i] = future.result()
+            sys.stderr.write('{}: {} ({:.1f}s)\n'.format(summaries[i]['input_annot_fname'], summaries[i]['status'], summaries[i]['wall_time']))
+
+    return summaries
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest',
+                        type=str,
+                        help='Manifest file name (.json): list of annotation file names, or of objects with input/output file names and options.',
+                        required=True)
+
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of series processed concurrently (default: number of CPUs).',
+                        default=os.cpu_count() or 1)
+
+    parser.add_argument('--output_dir',
+                        type=str,
+                        help='Output directory of the series without output file name in the manifest.')
+
+    parser.add_argument('--output_format',
+                        type=str,
+                        choices=['graphml', 'graphml.gz', 'npz', 'parquet', 'npy'],
+                        help='Format of the output files written to --output_dir (default: npz).',
+                        default='npz')
+
+    parser.add_argument('--summary_fname',
+                        type=str,
+                        help='Output summary file name (.json extension expected; standard output if none).')
+
+    parser.add_argument('--trace_memory',
+                        action='store_true',
+                        help='Record the peak memory of every stage of every series, which slows down execution.')
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    start = time.perf_counter()
+
+    series = read_manifest(args.manifest, args.output_dir, args.output_format)
+    summaries = run_batch(series, args.workers, args.trace_memory)
+
+    summary = {'wall_time': time.perf_counter() - start,
+               'workers': args.workers,
+               'series': summaries}
+
+    if args.summary_fname is not None:
+        with open(os.path.expanduser(args.summary_fname), 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if any(s['status'] != 'ok' for s in summaries):
+        sys.exit(1)
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import annotations
+import estimate_interactions
+import network_processing
+import graph_io
+
+from profiling import Profiler
+from speech_turns import SpeechTurns
+
+
+def synthetic_series(n_speakers=50, n_episodes=10, n_scenes=40, n_turns=30, n_seasons=1, n_storylines=8, seed=0):
+    """Generates synthetic annotations of a TV series, in the schema of the Serial Speakers dataset
+
+    Speakers are unevenly popular (Zipf-distributed, as main and secondary characters), and
+    gathered into storylines of a few characters. Every episode follows a few storylines: every
+    scene picks one of them, and a small cast among its characters (occasionally with a
+    character from another storyline). Speakers mostly alternate within a scene, with short
+    pauses and occasional long silences, as in dialogues.
+
+    Args:
+    n_speakers   (int):  number of speakers
+    n_episodes   (int):  number of episodes per season
+    n_scenes     (int):  mean number of scenes per episode
+    n_turns      (int):  mean number of speech turns per scene
+    n_seasons    (int):  number of seasons
+    n_storylines (int):  number of storylines
+    seed         (int):  random seed
+
+    Returns:
+    series       (dict): annotations, with seasons/episodes/duration/data/scenes/speech_segments
+    """
+
+    rng = np.random.default_rng(seed)
+    speakers = ['Speaker {:03d}'.format(k) for k in range(n_speakers)]
+
+    # main and secondary characters
+    popularity = 1 / np.arange(1, n_speakers + 1)
+    popularity /= popularity.sum()
+
+    # characters of every storyline
+    storylines = [rng.choice(n_speakers, size=min(n_speakers, rng.integers(3, 9)), replace=False, p=popularity)
+                  for _ in range(n_storylines)]
+
+    seasons = []
+    for _ in range(n_seasons):
+        episodes = []
+        for _ in range(n_episodes):
+            active = rng.choice(n_storylines, size=min(n_storylines, 3), replace=False)
+
+            scenes, speech_segments = [], []
+            time = 0.0
+            for _ in range(max(1, rng.poisson(n_scenes))):
+                scenes.append({'start': round(time, 2)})
+                time += rng.exponential(2.0)
+
+                # small cast, among the characters of one of the storylines of the episode
+                storyline = storylines[rng.choice(active)]
+                weights = popularity[storyline] / popularity[storyline].sum()
+                cast = list(rng.choice(storyline, size=min(len(storyline), rng.integers(2, 5)), replace=False, p=weights))
+                if rng.random() < 0.1:
+                    cast.append(rng.integers(n_speakers))
+
+                previous, current = None, rng.choice(cast)
+                for _ in range(max(1, rng.poisson(n_turns))):
+                    duration = rng.lognormal(0.8, 0.6)
+                    speech_segments.append({'start': round(time, 2),
+                                            'end': round(time + duration, 2),
+                                            'speaker': speakers[current]})
+
+                    # short pauses, occasional long silences
+                    time += duration + (rng.exponential(10.0) if rng.random() < 0.05 else rng.exponential(0.7))
+
+                    # mostly back-and-forth dialogues
+                    if previous is not None and previous != current and rng.random() < 0.6:
+                        previous, current = current, previous
+                    else:
+                        previous, current = current, rng.choice(cast)
+
+                time += rng.exponential(3.0)
+
+            episodes.append({'duration': round(time, 2),
+                             'data': {'scenes': scenes, 'speech_segments': speech_segments}})
+
+        seasons.append({'episodes': episodes})
+
+    return {'seasons': seasons}
+
+
+def benchmark_series(annot_fname, engine='loop', estimation_engine='loop', export_format='npz', workers=1, window=None, trace_memory=True):
+    """Times every stage of the generation of the dynamic network of a series
+    Args:
+    annot_fname       (str):  annotation file
+    engine            (str):  smoothing engine, 'loop' or 'vectorized'
+    estimation_engine (str):  interlocutor estimation engine, 'loop' or 'vectorized'
+    export_format     (str):  output format: 'graphml', 'npz' or 'npy'
+    workers           (int):  number of worker processes for narrative smoothing
+    window            (int):  smooth windows of this number of scenes at a time (all scenes at once if None)
+    trace_memory      (bool): record the peak memory of every stage
+
+    Returns:
+    report            (dict): wall time, peak memory, processed items and throughput (items/s) of every stage, and counters
+    """
+
+    profiler = Profiler(trace_memory=trace_memory)
+
+    episodes = list(profiler.iterate('load', annotations.iter_episodes(annot_fname)))
+
+    parts = []
+    for i, j, episode in episodes:
+        with profiler.stage('assign_speech_turns_to_scenes'):
+            speech_turns = SpeechTurns.from_episode(episode)
+
+        with profiler.stage('sequential'):
+            if estimation_engine == 'vectorized':
+                speech_turns = estimate_interactions.sequential_vectorized(speech_turns)
+            else:
+                speech_turns = estimate_interactions.sequential_columnar(speech_turns)
+
+        parts.append(('S{:02d}E{:02d}'.format(i+1, j+1), speech_turns))
+
+    speech_turns = SpeechTurns.concatenate([part for _, part in parts])
+    scene_mapping = [episode_id for episode_id, part in parts for k in range(part.n_scenes)]
+
+    with profiler.stage('build_interaction_network'):
+        R = network_processing.build_interaction_network(speech_turns)
+
+    with profiler.stage('narrative_smoothing'):
+        S = network_processing.narrative_smoothing(R, scene_mapping, engine=engine, compact=True, workers=workers, window=window)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with profiler.stage('export'):
+            path = os.path.join(tmp_dir, 'network.' + export_format)
+            if export_format == 'graphml':
+                network_processing.export_to_graphml_format(S, path)
+            else:
+                graph_io.export_to_binary_format(S, path)
+
+    profiler.count('episodes', len(episodes))
+    profiler.count('speech_turns', len(speech_turns))
+    profiler.count('scenes', len(scene_mapping))
+    profiler.count('speakers', len(R.nodes))
+    profiler.count('pairs', R.number_of_relations())
+    profiler.count('edges', S.number_of_edges())
+
+    # items processed by every stage
+    items = {'load': ('speech_turns', len(speech_turns)),
+             'assign_speech_turns_to_scenes': ('speech_turns', len(speech_turns)),
+             'sequential': ('speech_turns', len(speech_turns)),
+             'build_interaction_network': ('speech_turns', len(speech_turns)),
+             'narrative_smoothing': ('edges', S.number_of_edges()),
+             'export': ('edges', S.number_of_edges())}
+
+    report = profiler.report()
+    for name, stage in report['stages'].items():
+        stage['unit'], stage['items'] = items[name]
+        stage['throughput'] = stage['items'] / stage['wall_time'] if stage['wall_time'] > 0 else None
+
+    return report
+
+
+def run_benchmark(sizes, n_speakers=50, n_scenes=40, n_turns=30, seed=0, annot_dir=None, **kwargs):
+    """Benchmarks the generation of the dynamic network of synthetic series of increasing sizes
+    Args:
+    sizes      (list):  numbers of episodes of the synthetic series
+    n_speakers (int):   number of speakers
+    n_scenes   (int):   mean number of scenes per episode
+    n_turns    (int):   mean number of speech turns per scene
+    seed       (int):   random seed
+    annot_dir  (str):   directory where the synthetic annotation files are kept (temporary if None)
+    **kwargs   (dict):  options of benchmark_series
+
+    Returns:
+    reports    (list):  parameters and report (see benchmark_series) of every size
+    """
+
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if annot_dir is None:
+            annot_dir = tmp_dir
+        else:
+            annot_dir = os.path.expanduser(annot_dir)
+            os.makedirs(annot_dir, exist_ok=True)
+
+        for n_episodes in sizes:
+            parameters = {'n_speakers': n_speakers, 'n_episodes': n_episodes, 'n_scenes': n_scenes, 'n_turns': n_turns, 'seed': seed}
+
+            annot_fname = os.path.join(annot_dir, 'synthetic_{}.json'.format(n_episodes))
+            with open(annot_fname, 'w') as f:
+                json.dump(synthetic_series(n_speakers, n_episodes, n_scenes, n_turns, seed=seed), f)
+
+            report = benchmark_series(annot_fname, **kwargs)
+            report['parameters'] = parameters
+            reports.append(report)
+
+    return reports
+
+
+def format_report(report):
+    """Human-readable report of one size
+    Args:
+    report  (dict): parameters and report returned by benchmark_series
+
+    Returns:
+    summary (str):  one line per stage and counters
+    """
+
+    lines = ['{n_episodes} episodes, {n_speakers} speakers, ~{n_scenes} scenes per episode, ~{n_turns} turns per scene'.format(**report['parameters'])]
+    lines.append('  {:<32} {:>10} {:>24} {:>14}'.format('stage', 'time (s)', 'throughput', 'peak mem (MB)'))
+    for name, stage in report['stages'].items():
+        throughput = '{:.0f} {}/s'.format(stage['throughput'], stage['unit']) if stage['throughput'] is not None else '-'
+        peak = '{:.1f}'.format(stage['peak_memory'] / 2**20) if stage['peak_memory'] is not None else '-'
+        lines.append('  {:<32} {:>10.3f} {:>24} {:>14}'.format(name, stage['wall_time'], throughput, peak))
+    lines.append('  ' + ', '.join('{}: {}'.format(name, value) for name, value in report['counters'].items()))
+
+    return '\n'.join(lines)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        help='Numbers of episodes of the synthetic series (default: 5 10 20).',
+                        default=[5, 10, 20])
+
+    parser.add_argument('--speakers',
+                        type=int,
+                        help='Number of speakers (default: 50).',
+                        default=50)
+
+    parser.add_argument('--scenes',
+                        type=int,
+                        help='Mean number of scenes per episode (default: 40).',
+                        default=40)
+
+    parser.add_argument('--turns',
+                        type=int,
+                        help='Mean number of speech turns per scene (default: 30).',
+                        default=30)
+
+    parser.add_argument('--seed',
+                        type=int,
+                        help='Random seed (default: 0).',
+                        default=0)
+
+    parser.add_argument('--engine',
+                        type=str,
+                        choices=['loop', 'vectorized'],
+                        help='Narrative smoothing engine (default: loop).',
+                        default='loop')
+
+    parser.add_argument('--estimation_engine',
+                        type=str,
+                        choices=['loop', 'vectorized'],
+                        help='Interlocutor estimation engine (default: loop).',
+                        default='loop')
+
+    parser.add_argument('--export_format',
+                        type=str,
+                        choices=['graphml', 'npz', 'npy'],
+                        help='Output format of the export stage (default: npz).',
+                        default='npz')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of worker processes for narrative smoothing (default: 1).',
+                        default=1)
+
+    parser.add_argument('--window',
+                        type=int,
+                        help='Smooth windows of this number of scenes at a time.')
+
+    parser.add_argument('--no_memory',
+                        action='store_true',
+                        help='Do not trace the peak memory of every stage, which slows down execution.')
+
+    parser.add_argument('--annot_dir',
+                        type=str,
+                        help='Directory where the synthetic annotation files are kept (synthetic_<n_episodes>.json).')
+
+    parser.add_argument('--output_fname',
+                        type=str,
+                        help='Output benchmark report file name (.json extension expected).')
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    reports = run_benchmark(args.sizes,
+                            n_speakers=args.speakers,
+                            n_scenes=args.scenes,
+                            n_turns=args.turns,
+                            seed=args.seed,
+                            annot_dir=args.annot_dir,
+                            engine=args.engine,
+                            estimation_engine=args.estimation_engine,
+                            export_format=args.export_format,
+                            workers=args.workers,
+                            window=args.window,
+                            trace_memory=not args.no_memory)
+
+    for report in reports:
+        print(format_report(report))
+
+    if args.output_fname is not None:
+        with open(os.path.expanduser(args.output_fname), 'w') as f:
+            json.dump(reports, f, indent=2)
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def encode_scene_mapping(scene_mapping):
+    """Encodes the episode id of each scene as indices into the list of distinct episodes
+    Args:
+    scene_mapping (list):       episode id of each scene
+
+    Returns:
+    episodes      (list):       distinct episode ids, in order of appearance
+    scene_episode (np.ndarray): episode index of each scene
+    """
+
+    episodes = []
+    episode_idx = {}
+    scene_episode = np.empty(len(scene_mapping), dtype=np.int32)
+
+    for scene_idx, episode_id in enumerate(scene_mapping):
+        if episode_id not in episode_idx:
+            episode_idx[episode_id] = len(episodes)
+            episodes.append(episode_id)
+        scene_episode[scene_idx] = episode_idx[episode_id]
+
+    return episodes, scene_episode
+
+
+class DynamicNetwork:
+    """Compact, array-backed dynamic network of interpolated interaction weight by scene
+
+    Relations are stored in CSR layout: the i-th relation is weighted in scenes
+    scenes[indptr[i]:indptr[i+1]], with weights weights[indptr[i]:indptr[i+1]].
+    Episode ids are stored once per scene.
+
+    Args:
+    relations     (list):       (first speaker, second speaker) of every relation
+    indptr        (np.ndarray): offsets of every relation into scenes and weights, shape (n_relations+1,)
+    scenes        (np.ndarray): scene indices, in increasing order within each relation
+    weights       (np.ndarray): interpolated weight of the relation in each scene
+    episodes      (list):       distinct episode ids
+    scene_episode (np.ndarray): episode index of each scene
+    """
+
+    def __init__(self, relations, indptr, scenes, weights, episodes, scene_episode):
+        self.relations = list(relations)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.scenes = np.asarray(scenes, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.episodes = list(episodes)
+        self.scene_episode = np.asarray(scene_episode, dtype=np.int32)
+
+    @classmethod
+    def from_relations(cls, smoothed_relations, scene_mapping):
+        """Gathers the interpolated weights of every relation into a compact network
+        Args:
+        smoothed_relations (iterable):       (fSpk, sSpk, scene_indices, weights) of every relation
+        scene_mapping      (list):           episode id of each scene
+
+        Returns:
+        S                  (DynamicNetwork): compact dynamic network
+        """
+
+        relations = []
+        indptr = [0]
+        scenes = []
+        weights = []
+
+        for fSpk, sSpk, scene_indices, relation_weights in smoothed_relations:
+            relations.append((fSpk, sSpk))
+            indptr.append(indptr[-1] + len(scene_indices))
+            scenes.append(np.asarray(scene_indices, dtype=np.int32))
+            weights.append(np.asarray(relation_weights, dtype=np.float32))
+
+        episodes, scene_episode = encode_scene_mapping(scene_mapping)
+
+        return cls(relations,
+                   indptr,
+                   np.concatenate(scenes) if scenes else np.empty(0, dtype=np.int32),
+                   np.concatenate(weights) if weights else np.empty(0, dtype=np.float32),
+                   episodes,
+                   scene_episode)
+
+    @property
+    def nodes(self):
+        """Speakers involved in some relation, in order of appearance"""
+
+        return list(dict.fromkeys(spk for relation in self.relations for spk in relation))
+
+    @property
+    def scene_mapping(self):
+        """Episode id of each scene"""
+
+        return [self.episodes[episode_idx] for episode_idx in self.scene_episode]
+
+    def number_of_edges(self):
+        """Number of (relation, scene) edges"""
+
+        return self.scenes.shape[0]
+
+    def relation(self, i):
+        """Scenes and weights of the i-th relation
+        Args:
+        i       (int):        relation index
+
+        Returns:
+        scenes  (np.ndarray): scenes in which the relation is weighted
+        weights (np.ndarray): weight of the relation in these scenes
+        """
+
+        start, stop = self.indptr[i], self.indptr[i+1]
+
+        return self.scenes[start:stop], self.weights[start:stop]
+
+    def smoothed_relations(self):
+        """Iterates over the relations of the network, as generated by narrative smoothing
+
+        Yields:
+        fSpk          (str):        first speaker
+        sSpk          (str):        second speaker
+        scene_indices (np.ndarray): scenes in which the relation is weighted, in increasing order
+        weights       (np.ndarray): interpolated weight of the relation in these scenes, rounded to 4 decimals
+        """
+
+        for i, (fSpk, sSpk) in enumerate(self.relations):
+            scenes, weights = self.relation(i)
+
+            # weights are stored in single precision
+            yield fSpk, sSpk, scenes, np.round(weights.astype(np.float64), 4)
+
+    def edges(self):
+        """Iterates over the edges of the network, relation after relation
+
+        Yields:
+        fSpk      (str):   first speaker
+        sSpk      (str):   second speaker
+        scene_idx (int):   scene index
+        weight    (float): interpolated weight, rounded to 4 decimals
+        episode   (str):   episode id
+        """
+
+        for fSpk, sSpk, scenes, weights in self.smoothed_relations():
+            for scene_idx, weight in zip(scenes.tolist(), weights):
+                yield fSpk, sSpk, scene_idx, weight, self.episodes[self.scene_episode[scene_idx]]
+
+    def to_networkx(self):
+        """Converts the network to the multigraph returned by network_processing.narrative_smoothing
+
+        Returns:
+        S (nx.MultiGraph): undirected multigraph of interpolated interaction weight by scene
+        """
+
+        import networkx as nx
+
+        S = nx.MultiGraph()
+        S.add_nodes_from(self.nodes)
+
+        S.add_edges_from((fSpk, sSpk, scene_idx, {'weight': weight, 'episode': episode})
+                         for fSpk, sSpk, scene_idx, weight, episode in self.edges())
+
+        return S
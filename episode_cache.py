@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from speech_turns import SpeechTurns
+
+
+# bumped whenever the preprocessing or the storage format changes, to invalidate previous entries
+CACHE_VERSION = 2
+
+
+class EpisodeCache:
+    """On-disk cache of preprocessed episodes, keyed by a hash of their annotations and preprocessing parameters
+
+    Every entry stores the columnar speech turns of an episode, with their interlocutors, as
+    distributed over its scenes, in a .npz archive. Entries beyond the size limit are evicted, least
+    recently used first.
+
+    Args:
+    cache_dir (str): cache directory (created if needed)
+    max_size  (int): maximum size of the cache in bytes (unbounded if None)
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, episode, inter_threshold):
+        """Content hash of an episode and its preprocessing parameters
+        Args:
+        episode         (dict):  episode annotations
+        inter_threshold (float): maximum silence duration between verbal interactions
+
+        Returns:
+        key             (str):   hexadecimal digest
+        """
+
+        h = hashlib.sha256()
+        h.update(json.dumps([CACHE_VERSION, inter_threshold]).encode('utf-8'))
+        h.update(json.dumps(episode, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        """Loads the preprocessed speech turns of an episode, if cached
+        Args:
+        key          (str):         episode key
+
+        Returns:
+        speech_turns (SpeechTurns): columnar speech turns with interlocutors (None if not cached)
+        """
+
+        path = self._path(key)
+
+        try:
+            with np.load(path) as data:
+                speech_turns = SpeechTurns.from_arrays({column: data[column] for column in data.files})
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return speech_turns
+
+    def put(self, key, speech_turns):
+        """Stores the preprocessed speech turns of an episode
+        Args:
+        key          (str):         episode key
+        speech_turns (SpeechTurns): columnar speech turns with interlocutors
+
+        Returns:
+        None
+        """
+
+        arrays = speech_turns.to_arrays()
+
+        # write atomically, as several processes may share the cache
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in its maximum size
+
+        Returns:
+        None
+        """
+
+        if self.max_size is None:
+            return
+
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.npz'):
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, fname))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fname))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, fname in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, fname))
+            except FileNotFoundError:
+                pass
+            size -= entry_size
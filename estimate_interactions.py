@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import numpy as np
+
 from utils import speech_turns_to_speaker_turns, speaker_turns_to_speech_turns
 
 
@@ -143,3 +145,247 @@ def sequential(scene_speech_turns, inter_threshold=5.0):
         new_scene_speech_turns.append(speaker_turns_to_speech_turns(speaker_turns))
         
     return new_scene_speech_turns
+
+
+def _merge_interlocutors(speech_turns, estimated, keep_manual):
+    """Gathers the estimated and manually annotated interlocutors of every speech turn
+    Args:
+    speech_turns    (SpeechTurns): columnar speech turns, with manual interlocutors if any
+    estimated       (np.ndarray):  speaker id of the estimated interlocutor of every speech turn (-1 if none)
+    keep_manual     (np.ndarray):  whether to keep the manual interlocutors of every speech turn
+
+    Returns:
+    interloc_indptr (np.ndarray):  offsets of every speech turn into interloc_ids
+    interloc_ids    (np.ndarray):  speaker ids of the interlocutors
+    """
+
+    manual_counts = np.diff(speech_turns.interloc_indptr)
+    counts = np.where(keep_manual, manual_counts, estimated >= 0)
+
+    interloc_indptr = np.zeros(len(speech_turns) + 1, dtype=np.int64)
+    np.cumsum(counts, out=interloc_indptr[1:])
+    interloc_ids = np.empty(interloc_indptr[-1], dtype=np.int32)
+
+    # estimated interlocutors
+    est = ~keep_manual & (estimated >= 0)
+    interloc_ids[interloc_indptr[:-1][est]] = estimated[est]
+
+    # manual interlocutors, shifted to their new offsets
+    turn = np.repeat(np.arange(len(speech_turns)), manual_counts)
+    kept = keep_manual[turn]
+    shift = interloc_indptr[:-1] - speech_turns.interloc_indptr[:-1]
+    interloc_ids[np.flatnonzero(kept) + shift[turn[kept]]] = speech_turns.interloc_ids[kept]
+
+    return interloc_indptr, interloc_ids
+
+
+def sequential_columnar(speech_turns, inter_threshold=5.0):
+    """For each speech turn, estimates the interlocutors from the surrounding speakers, as sequential, on columnar speech turns
+    Args:
+    speech_turns     (SpeechTurns): columnar speech turns, as distributed over every scene
+    inter_threshold  (float):       maximum silence duration between verbal interactions
+
+    Returns:
+    new_speech_turns (SpeechTurns): columnar speech turns, with interlocutors
+    """
+
+    n_turns = len(speech_turns)
+    speaker = speech_turns.speaker.tolist()
+    start = speech_turns.start.tolist()
+    end = speech_turns.end.tolist()
+
+    # estimated interlocutor of every speech turn (-1 if none), unless manually annotated
+    estimated = np.full(n_turns, -1, dtype=np.int32)
+    keep_manual = speech_turns.annotated.copy()
+
+    # speaker turns: consecutive speech turns originating in the same speaker, within a scene
+    run_start = np.ones(n_turns, dtype=bool)
+    run_start[1:] = speech_turns.speaker[1:] != speech_turns.speaker[:-1]
+    run_start[speech_turns.scene_offsets[:-1][speech_turns.scene_offsets[:-1] < n_turns]] = True
+    run_bounds = np.append(np.flatnonzero(run_start), n_turns).tolist()
+    scene_runs = np.searchsorted(run_bounds[:-1], speech_turns.scene_offsets).tolist()
+
+    def set_interlocs(r, interloc):
+        # keep manual annotation if available; otherwise, use hypothesized interlocutor
+        estimated[run_bounds[r]:run_bounds[r+1]] = interloc
+
+    for scene_id in range(speech_turns.n_scenes):
+        first, last = scene_runs[scene_id], scene_runs[scene_id+1] - 1
+
+        if last == first:
+            # single speaker turn: no interlocutor
+            keep_manual[run_bounds[first]:run_bounds[first+1]] = False
+            continue
+
+        for r in range(first, last + 1):
+            curr_speaker = speaker[run_bounds[r]]
+            curr_start = start[run_bounds[r]]
+            curr_end = end[run_bounds[r+1]-1]
+
+            # rule (2a): |spk_1 -> spk_2
+            if r == first:
+                next_start = start[run_bounds[r+1]]
+                set_interlocs(r, speaker[run_bounds[r+1]] if (next_start - curr_end) <= inter_threshold else -1)
+
+            # rule (2b): spk_1 <- spk_2|
+            elif r == last:
+                prev_end = end[run_bounds[r]-1]
+                set_interlocs(r, speaker[run_bounds[r]-1] if (curr_start - prev_end) <= inter_threshold else -1)
+
+            # rule (1): spk_1 <- spk_2 -> spk_1
+            elif speaker[run_bounds[r]-1] == speaker[run_bounds[r+1]]:
+                prev_end = end[run_bounds[r]-1]
+                next_start = start[run_bounds[r+1]]
+                close = (curr_start - prev_end) <= inter_threshold or (next_start - curr_end) <= inter_threshold
+                set_interlocs(r, speaker[run_bounds[r]-1] if close else -1)
+
+            else:
+                prev_speaker = speaker[run_bounds[r]-1]
+                prev_end = end[run_bounds[r]-1]
+                next_speaker = speaker[run_bounds[r+1]]
+                next_start = start[run_bounds[r+1]]
+
+                # tests if current speaker was already speaking before the previous one
+                inter_prev_occ = (r >= first + 2 and speaker[run_bounds[r-1]-1] == curr_speaker)
+
+                # tests if current speaker will be speaking after the next one
+                inter_next_occ = (r < last - 1 and speaker[run_bounds[r+2]] == curr_speaker)
+
+                # rule (3a): (spk_2) - spk_1 <- spk_2 - spk_3
+                if inter_prev_occ and not inter_next_occ:
+                    set_interlocs(r, prev_speaker if (curr_start - prev_end) <= inter_threshold else -1)
+
+                # rule (3b): spk_1 - spk_2 -> spk_3 - (spk_2)
+                elif not inter_prev_occ and inter_next_occ:
+                    set_interlocs(r, next_speaker if (next_start - curr_end) <= inter_threshold else -1)
+
+                # rule (4): (spk) - spk_1 <- spk_2 -> spk_3 - (spk)
+                else:
+                    lim = (prev_end + next_start) / 2
+
+                    for t in range(run_bounds[r], run_bounds[r+1]):
+                        speech_turn_pos = (start[t] + end[t]) / 2
+                        if speech_turn_pos <= lim:
+                            keep_manual[t] = False
+                            estimated[t] = prev_speaker if (curr_start - prev_end) <= inter_threshold else -1
+                        elif speech_turn_pos > lim:
+                            keep_manual[t] = False
+                            estimated[t] = next_speaker if (next_start - curr_end) <= inter_threshold else -1
+
+    return speech_turns.with_interlocutors(*_merge_interlocutors(speech_turns, estimated, keep_manual))
+
+
+def speaker_turn_rules(speech_turns):
+    """Segments speech turns into speaker turns and finds the rule applying to each, regardless of silence durations
+    Args:
+    speech_turns (SpeechTurns): columnar speech turns, as distributed over every scene (of an episode or a whole series)
+
+    Returns:
+    rules        (dict):        speaker turn lengths, surrounding speakers and silences, and masks of the rules, by speaker turn
+    """
+
+    n_turns = len(speech_turns)
+    speaker, start, end = speech_turns.speaker, speech_turns.start, speech_turns.end
+    scene_offsets = speech_turns.scene_offsets
+
+    # speaker turns: consecutive speech turns originating in the same speaker, within a scene
+    run_start = np.ones(n_turns, dtype=bool)
+    run_start[1:] = speaker[1:] != speaker[:-1]
+    run_start[scene_offsets[:-1][scene_offsets[:-1] < n_turns]] = True
+    run_bounds = np.append(np.flatnonzero(run_start), n_turns)
+    n_runs = run_bounds.shape[0] - 1
+
+    # first and last speaker turns of the scene of every speaker turn
+    scene_runs = np.searchsorted(run_bounds[:-1], scene_offsets)
+    run_scene = np.repeat(np.arange(speech_turns.n_scenes), np.diff(scene_runs))
+    run_idx = np.arange(n_runs)
+    first = scene_runs[run_scene]
+    last = scene_runs[run_scene + 1] - 1
+
+    # speaker, start and end of every speaker turn, and of the surrounding ones (-1/NaN past the bounds)
+    curr_speaker = speaker[run_bounds[:-1]]
+    curr_start = start[run_bounds[:-1]]
+    curr_end = end[run_bounds[1:] - 1]
+
+    def shifted(values, k, fill):
+        out = np.full(n_runs, fill, dtype=values.dtype)
+        if k > 0:
+            out[:n_runs-k] = values[k:]
+        else:
+            out[-k:] = values[:n_runs+k]
+        return out
+
+    prev_end, next_start = shifted(curr_end, -1, np.nan), shifted(curr_start, 1, np.nan)
+
+    rules = {'run_lengths': np.diff(run_bounds),
+             'prev_speaker': shifted(curr_speaker, -1, -1),
+             'next_speaker': shifted(curr_speaker, 1, -1),
+             'prev_silence': curr_start - prev_end,
+             'next_silence': next_start - curr_end,
+             'lim': (prev_end + next_start) / 2}
+
+    # rules, by order of precedence
+    single = first == last
+    is_first = ~single & (run_idx == first)
+    is_last = ~single & ~is_first & (run_idx == last)
+    middle = ~single & ~is_first & ~is_last
+    rule_1 = middle & (rules['prev_speaker'] == rules['next_speaker'])
+    others = middle & ~rule_1
+
+    # tests if current speaker was already speaking before the previous one, or will be speaking after the next one
+    inter_prev_occ = (run_idx >= first + 2) & (shifted(curr_speaker, -2, -1) == curr_speaker)
+    inter_next_occ = (run_idx < last - 1) & (shifted(curr_speaker, 2, -1) == curr_speaker)
+
+    rules['single'] = single
+    rules['to_next'] = is_first | (others & ~inter_prev_occ & inter_next_occ)
+    rules['to_prev'] = is_last | (others & inter_prev_occ & ~inter_next_occ)
+    rules['rule_1'] = rule_1
+    rules['rule_4'] = others & (inter_prev_occ == inter_next_occ)
+
+    return rules
+
+
+def sequential_vectorized(speech_turns, inter_threshold=5.0, rules=None):
+    """For each speech turn, estimates the interlocutors from the surrounding speakers, as sequential, with array operations over all scenes at once
+    Args:
+    speech_turns     (SpeechTurns): columnar speech turns, as distributed over every scene (of an episode or a whole series)
+    inter_threshold  (float):       maximum silence duration between verbal interactions
+    rules            (dict):        speaker turn rules returned by speaker_turn_rules (computed if None)
+
+    Returns:
+    new_speech_turns (SpeechTurns): columnar speech turns, with interlocutors
+    """
+
+    if rules is None:
+        rules = speaker_turn_rules(speech_turns)
+
+    run_lengths = rules['run_lengths']
+    prev_speaker, next_speaker = rules['prev_speaker'], rules['next_speaker']
+
+    prev_close = rules['prev_silence'] <= inter_threshold
+    next_close = rules['next_silence'] <= inter_threshold
+
+    # estimated interlocutor of every speaker turn (-1 if none)
+    run_estimated = np.full(run_lengths.shape[0], -1, dtype=np.int32)
+    to_next = rules['to_next'] & next_close
+    to_prev = (rules['to_prev'] & prev_close) | (rules['rule_1'] & (prev_close | next_close))
+    run_estimated[to_next] = next_speaker[to_next]
+    run_estimated[to_prev] = prev_speaker[to_prev]
+
+    estimated = np.repeat(run_estimated, run_lengths)
+
+    # single speaker turn: no interlocutor, even if manually annotated
+    keep_manual = speech_turns.annotated & ~np.repeat(rules['single'], run_lengths)
+
+    # rule (4): speech turns split at the middle of the surrounding silences, regardless of manual annotations
+    turn_rule_4 = np.repeat(rules['rule_4'], run_lengths)
+    pos = (speech_turns.start + speech_turns.end) / 2
+    lim = np.repeat(rules['lim'], run_lengths)
+    before = turn_rule_4 & (pos <= lim)
+    after = turn_rule_4 & (pos > lim)
+
+    estimated[before] = np.where(np.repeat(prev_close, run_lengths), np.repeat(prev_speaker, run_lengths), -1)[before]
+    estimated[after] = np.where(np.repeat(next_close, run_lengths), np.repeat(next_speaker, run_lengths), -1)[after]
+    keep_manual &= ~(before | after)
+
+    return speech_turns.with_interlocutors(*_merge_interlocutors(speech_turns, estimated, keep_manual))
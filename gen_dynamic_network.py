@@ -4,15 +4,128 @@
 import sys
 import argparse
 import os
-import json
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import annotations
 import estimate_interactions
 import network_processing
+import graph_io
+
+from episode_cache import EpisodeCache
+from incremental import SmoothingState
+from profiling import Profiler, Progress, stage
+from speech_turns import SpeechTurns
+
+
+def preprocess_episode(episode, inter_threshold=5.0, estimation_engine='loop', profiler=None):
+    """Distributes the speech turns of an episode over its scenes and estimates their interlocutors
+    Args:
+    episode           (dict):        episode annotations
+    inter_threshold   (float):       maximum silence duration between verbal interactions
+    estimation_engine (str):         interlocutor estimation engine, 'loop' or 'vectorized' (same result)
+    profiler          (Profiler):    records both stages (none if None)
+
+    Returns:
+    speech_turns      (SpeechTurns): columnar speech turns with interlocutors, as distributed over every scene
+    """
+
+    # assign speech turns to scenes
+    with stage(profiler, 'scene_assignment'):
+        speech_turns = SpeechTurns.from_episode(episode)
 
-from utils import assign_speech_turns_to_scenes
+    # estimate the interlocutors from the sequence of speech turns
+    with stage(profiler, 'interlocutor_estimation'):
+        if estimation_engine == 'vectorized':
+            return estimate_interactions.sequential_vectorized(speech_turns, inter_threshold)
 
+        return estimate_interactions.sequential_columnar(speech_turns, inter_threshold)
+
+
+def _preprocess_identified_episode(identified_episode, inter_threshold=5.0, estimation_engine='loop', cache=None, profiler=None):
+    """Preprocesses an episode, keeping track of its id
+    Args:
+    identified_episode (tuple):        episode id and annotations
+    inter_threshold    (float):        maximum silence duration between verbal interactions
+    estimation_engine  (str):          interlocutor estimation engine, 'loop' or 'vectorized'
+    cache              (EpisodeCache): cache of preprocessed episodes (none if None)
+    profiler           (Profiler):     records the preprocessing stages (none if None)
 
-def gen_dynamic_network(input_annot_fname, output_graph_fname):
+    Returns:
+    identified_turns   (tuple):        episode id and columnar speech turns with interlocutors
+    """
+
+    episode_id, episode = identified_episode
+
+    if cache is None:
+        return episode_id, preprocess_episode(episode, inter_threshold, estimation_engine, profiler)
+
+    # the estimation engine is left out of the key on purpose: both engines give identical speech turns, and share cache entries
+    key = cache.key(episode, inter_threshold)
+
+    with stage(profiler, 'cache'):
+        speech_turns = cache.get(key)
+
+    if speech_turns is None:
+        speech_turns = preprocess_episode(episode, inter_threshold, estimation_engine, profiler)
+        with stage(profiler, 'cache'):
+            cache.put(key, speech_turns)
+    elif profiler is not None:
+        profiler.count('cached_episodes')
+
+    return episode_id, speech_turns
+
+
+def _ordered_map(executor, fn, iterable, max_pending):
+    """Maps fn over iterable with executor, in order, with a bounded number of pending items
+    Args:
+    executor    (Executor): pool of workers
+    fn          (callable): function to map
+    iterable    (iterable): inputs, consumed as results are retrieved
+    max_pending (int):      maximum number of submitted inputs not yet retrieved
+
+    Yields:
+    result      (object):   result of fn on every input, in order
+    """
+
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _new_episodes(input_annot_fname, processed_episodes):
+    """Reads the episodes not processed yet from an annotation file, one at a time
+    Args:
+    input_annot_fname  (str):   input annotation file (possibly gzip-compressed)
+    processed_episodes (set):   ids of the episodes already processed
+
+    Yields:
+    identified_episode (tuple): episode id and annotations
+    """
+
+    new_episodes = False
+
+    for i, j, episode in annotations.iter_episodes(input_annot_fname):
+        episode_id = 'S{:02d}E{:02d}'.format(i+1, j+1)
+
+        # skip the episodes already smoothed
+        if episode_id in processed_episodes:
+            if new_episodes:
+                raise ValueError('Episode {} precedes new episodes: only appended episodes can be processed incrementally'.format(episode_id))
+            continue
+
+        new_episodes = True
+        yield episode_id, episode
+
+
+def gen_dynamic_network(input_annot_fname, output_graph_fname=None, engine='loop', compact=False, stream=False, output_binary_fname=None, state_fname=None, workers=1, preprocess_workers=1, inter_threshold=5.0, estimation_engine='loop', cache_dir=None, cache_max_size=None, min_weight=None, window=None, profiler=None, progress=False):
     """Generates a dynamic network of interacting speakers within TV serials
 
     References:
@@ -20,53 +133,139 @@ def gen_dynamic_network(input_annot_fname, output_graph_fname):
     X. Bost, V. Labatut, S. Gueye, G. Linarès, Narrative Smoothing: Dynamic Conversational Network for the Analysis of TV Series Plots, ASONAM/DyNo 2016
     
     Args:
-    input_annot_fname  (str):           input annotation file
-    output_graph_fname (str):           output graph file
+    input_annot_fname   (str):           input annotation file (possibly gzip-compressed)
+    output_graph_fname  (str):           output graph file (none if None)
+    engine              (str):           smoothing engine, 'loop' or 'vectorized'
+    compact             (bool):          keep the dynamic network as a compact DynamicNetwork
+    stream              (bool):          write out the graph file while smoothing, without keeping the dynamic network
+    output_binary_fname (str):           output columnar binary file (.npz, .parquet or .npy directory; none if None)
+    state_fname         (str):           smoothing state file (.npz): if it exists, only the episodes appended since are processed
+    workers             (int):           number of worker processes for narrative smoothing
+    preprocess_workers  (int):           number of worker processes for the preprocessing of episodes
+    inter_threshold     (float):         maximum silence duration between verbal interactions
+    estimation_engine   (str):           interlocutor estimation engine, 'loop' or 'vectorized'
+    cache_dir           (str):           directory of the cache of preprocessed episodes (no cache if None)
+    cache_max_size      (int):           maximum size of the cache in bytes (unbounded if None)
+    min_weight          (float):         leave out the edges weighted less (none if None)
+    window              (int):           smooth windows of this number of scenes at a time, in bounded memory (all scenes at once if None)
+    profiler            (Profiler):      records the wall time and peak memory of every stage, and counts episodes, scenes, pairs and edges (none if None)
+    progress            (bool):          report the progress of narrative smoothing on the standard error
 
     Returns:
-    S                  (nx.MultiGraph): dynamic network of interacting speakers
+    S                   (nx.MultiGraph or DynamicNetwork): dynamic network of interacting speakers (None if streamed)
     """
 
-    all_speech_turns = [] # speech turns gathered by scenes
-    scene_mapping = []    # mapping between scenes and episode ids
-    
     # expand input paths
     input_annot_fname = os.path.expanduser(input_annot_fname)
-    output_graph_fname = os.path.expanduser(output_graph_fname)
-
-    # load annotations as dict
-    annotations = json.load(open(input_annot_fname))
-
-    # loop over episodes
-    seasons = annotations['seasons']
-    for i, season in enumerate(seasons):
-        episodes = season['episodes']
-        for j, episode in enumerate(episodes):
-            
-            scenes = episode['data']['scenes']
-            speech_turns = episode['data']['speech_segments']
-            episode_duration = episode['duration']
-            episode_id = 'S{:02d}E{:02d}'.format(i+1, j+1)
-            
-            # assign speech turns to scenes
-            scene_speech_turns = assign_speech_turns_to_scenes(scenes, speech_turns, episode_duration)
-            
-            # estimate the interlocutors from the sequence of speech turns
-            scene_speech_turns = estimate_interactions.sequential(scene_speech_turns)
-            
-            # record episode id
-            scene_mapping += [episode_id for k in range(len(scene_speech_turns))]
-
-            # append speech turns
-            all_speech_turns += scene_speech_turns
-    
-    # dynamic network of raw interaction time
-    R = network_processing.build_interaction_network(all_speech_turns)
+    if output_graph_fname is not None:
+        output_graph_fname = os.path.expanduser(output_graph_fname)
+    if output_binary_fname is not None:
+        output_binary_fname = os.path.expanduser(output_binary_fname)
+    if state_fname is not None:
+        state_fname = os.path.expanduser(state_fname)
 
-    # dynamic network of interpolated/smoothed interaction weight
-    S = network_processing.narrative_smoothing(R, scene_mapping)
-    
-    network_processing.export_to_graphml_format(S, output_graph_fname)
+    if min_weight is not None and state_fname is not None:
+        raise ValueError('Edges weighted less than min_weight cannot be left out when updating a smoothing state')
+
+    if window is not None and state_fname is not None:
+        raise ValueError('A smoothing state cannot be recorded from windows of scenes')
+
+    # previous smoothing state, if any
+    state = None
+    if state_fname is not None and os.path.exists(state_fname):
+        state = SmoothingState.load(state_fname)
+    processed_episodes = set(state.scene_mapping) if state is not None else set()
+
+    # stream annotations, one episode at a time
+    new_episodes = _new_episodes(input_annot_fname, processed_episodes)
+
+    # cache of preprocessed episodes
+    cache = EpisodeCache(cache_dir, cache_max_size) if cache_dir is not None else None
+    preprocess = partial(_preprocess_identified_episode, inter_threshold=inter_threshold,
+                         estimation_engine=estimation_engine, cache=cache)
+
+    # speech turns with interlocutors, gathered by scenes, for every episode (in order)
+    if preprocess_workers > 1:
+        # episodes are read and preprocessed at the same time, in other processes
+        with stage(profiler, 'preprocessing'), ProcessPoolExecutor(preprocess_workers) as executor:
+            episode_speech_turns = list(_ordered_map(executor, preprocess, new_episodes, 2 * preprocess_workers))
+    else:
+        if profiler is not None:
+            new_episodes = profiler.iterate('load', new_episodes)
+        episode_speech_turns = [preprocess(episode, profiler=profiler) for episode in new_episodes]
+
+    if cache is not None:
+        with stage(profiler, 'cache'):
+            cache.evict()
+
+    # speech turns gathered by scenes
+    all_speech_turns = SpeechTurns.concatenate([speech_turns for _, speech_turns in episode_speech_turns])
+
+    # mapping between scenes and episode ids
+    scene_mapping = [episode_id for episode_id, speech_turns in episode_speech_turns
+                     for k in range(speech_turns.n_scenes)]
+
+    if profiler is not None:
+        profiler.count('episodes', len(episode_speech_turns))
+        profiler.count('speech_turns', len(all_speech_turns))
+        profiler.count('scenes', len(scene_mapping))
+
+    # progress of narrative smoothing, also counting the edges emitted
+    smoothing_progress = Progress('Smoothing', interval=1.0 if progress else None)
+
+    if state is not None:
+        # update the dynamic network with the new episodes only
+        with stage(profiler, 'smoothing'):
+            S = state.update(all_speech_turns, scene_mapping)
+
+        if profiler is not None:
+            profiler.count('speakers', len(S.nodes))
+            profiler.count('pairs', len(S.relations))
+        smoothing_progress.edges = S.number_of_edges()
+
+    else:
+        # dynamic network of raw interaction time
+        with stage(profiler, 'network_build'):
+            R = network_processing.build_interaction_network(all_speech_turns)
+
+        if profiler is not None:
+            profiler.count('speakers', len(R.nodes))
+            profiler.count('pairs', R.number_of_relations())
+
+        # dynamic network of interpolated/smoothed interaction weight
+        if stream and output_binary_fname is None and state_fname is None:
+            # edges are written out as they are smoothed
+            with stage(profiler, 'smoothing'):
+                network_processing.narrative_smoothing_to_graphml(R, scene_mapping, output_graph_fname, engine=engine, workers=workers, min_weight=min_weight,
+                                                                  window=window, progress=smoothing_progress)
+            if profiler is not None:
+                profiler.count('edges', smoothing_progress.edges)
+            return None
+
+        # the binary output and the smoothing state are recorded from the compact network
+        compact = compact or output_binary_fname is not None or state_fname is not None
+
+        with stage(profiler, 'smoothing'):
+            index = network_processing.InteractionTimeIndex(R, len(scene_mapping)) if window is None else None
+            S = network_processing.narrative_smoothing(R, scene_mapping, index=index, engine=engine, compact=compact, workers=workers, min_weight=min_weight,
+                                                       window=window, progress=smoothing_progress)
+
+        if state_fname is not None:
+            with stage(profiler, 'smoothing'):
+                state = SmoothingState.from_network(R, scene_mapping, S, index)
+
+    if profiler is not None:
+        profiler.count('edges', smoothing_progress.edges)
+
+    with stage(profiler, 'export'):
+        if state_fname is not None:
+            state.save(state_fname)
+
+        if output_graph_fname is not None:
+            network_processing.export_to_graphml_format(S, output_graph_fname)
+
+        if output_binary_fname is not None:
+            graph_io.export_to_binary_format(S, output_binary_fname)
                      
     return S
 
@@ -75,17 +274,111 @@ def parse_arguments(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_annot_fname',
                         type=str,
-                        help='Annotation file name.',
+                        help='Annotation file name (.json, possibly gzip-compressed).',
                         required=True)
 
     parser.add_argument('--output_graph_fname',
                         type=str,
-                        help='Output graph file name (.graphml extension expected).',
-                        required=True)
+                        help='Output graph file name (.graphml extension expected, .graphml.gz for gzip-compressed output).')
+
+    parser.add_argument('--output_binary_fname',
+                        type=str,
+                        help='Output columnar binary file name (.npz, .parquet, or directory of memory-mappable .npy files).')
+
+    parser.add_argument('--engine',
+                        type=str,
+                        choices=['loop', 'vectorized'],
+                        help='Narrative smoothing engine: relation by relation (default) or vectorized over all relations.',
+                        default='loop')
+
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Write out the graph file while smoothing, in constant memory with respect to the number of edges.')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of worker processes for narrative smoothing (default: 1).',
+                        default=1)
+
+    parser.add_argument('--preprocess_workers',
+                        type=int,
+                        help='Number of worker processes for the preprocessing of episodes (default: 1).',
+                        default=1)
+
+    parser.add_argument('--inter_threshold',
+                        type=float,
+                        help='Maximum silence duration (in seconds) between verbal interactions (default: 5.0).',
+                        default=5.0)
+
+    parser.add_argument('--estimation_engine',
+                        type=str,
+                        choices=['loop', 'vectorized'],
+                        help='Interlocutor estimation engine: speaker turn by speaker turn (default) or vectorized over whole episodes. Both give the same result.',
+                        default='loop')
+
+    parser.add_argument('--cache_dir',
+                        type=str,
+                        help='Directory of the cache of preprocessed episodes. Episodes with unchanged annotations are not preprocessed again.')
+
+    parser.add_argument('--cache_max_size',
+                        type=int,
+                        help='Maximum size of the cache of preprocessed episodes, in bytes (default: unbounded).')
+
+    parser.add_argument('--min_weight',
+                        type=float,
+                        help='Leave out the edges weighted less than this value (e.g. 0.0001 to drop zero weights). Not compatible with --state_fname.')
 
-    return parser.parse_args(argv)
+    parser.add_argument('--window',
+                        type=int,
+                        help='Smooth windows of this number of scenes at a time, in memory bounded by the window size instead of the number of scenes. Not compatible with --workers or --state_fname.')
+
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Print the wall time and peak memory of every stage, with counts of scenes, pairs and edges, on the standard error.')
+
+    parser.add_argument('--profile_fname',
+                        type=str,
+                        help='Output profiling report file name (.json extension expected); implies --profile.')
+
+    parser.add_argument('--state_fname',
+                        type=str,
+                        help='Smoothing state file name (.npz extension expected). If the file exists, only the episodes appended since the previous run are processed.')
+
+    args = parser.parse_args(argv)
+
+    if args.output_graph_fname is None and args.output_binary_fname is None:
+        parser.error('at least one of --output_graph_fname and --output_binary_fname is required')
+
+    if args.min_weight is not None and args.state_fname is not None:
+        parser.error('--min_weight cannot be used with --state_fname')
+
+    if args.window is not None and (args.workers > 1 or args.state_fname is not None):
+        parser.error('--window cannot be used with --workers or --state_fname')
+
+    return args
 
 
 if __name__ == '__main__':
     args = parse_arguments(sys.argv[1:])
-    gen_dynamic_network(args.input_annot_fname, args.output_graph_fname)
+    profiler = Profiler() if args.profile or args.profile_fname is not None else None
+    gen_dynamic_network(args.input_annot_fname,
+                        args.output_graph_fname,
+                        engine=args.engine,
+                        stream=args.stream,
+                        output_binary_fname=args.output_binary_fname,
+                        state_fname=args.state_fname,
+                        workers=args.workers,
+                        preprocess_workers=args.preprocess_workers,
+                        inter_threshold=args.inter_threshold,
+                        estimation_engine=args.estimation_engine,
+                        cache_dir=args.cache_dir,
+                        cache_max_size=args.cache_max_size,
+                        min_weight=args.min_weight,
+                        window=args.window,
+                        profiler=profiler,
+                        progress=True)
+
+    if profiler is not None:
+        sys.stderr.write(profiler.summary() + '\n')
+        if args.profile_fname is not None:
+            profiler.save(os.path.expanduser(args.profile_fname))
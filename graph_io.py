@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from dynamic_network import DynamicNetwork
+
+
+_GRAPHML_HEADER = """<?xml version='1.0' encoding='utf-8'?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">
+  <key id="d1" for="edge" attr.name="episode" attr.type="string" />
+  <key id="d0" for="edge" attr.name="weight" attr.type="float" />
+  <graph edgedefault="undirected">
+"""
+
+_GRAPHML_FOOTER = """  </graph>
+</graphml>
+"""
+
+_GRAPHML_EDGE = """    <edge source={} target={} id="{}">
+      <data key="d0">{}</data>
+      <data key="d1">{}</data>
+    </edge>
+"""
+
+# same escaping as xml.etree.ElementTree
+_ATTRIB_ENTITIES = {'"': '&quot;', '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'}
+
+
+def _quote_attrib(value):
+    return '"{}"'.format(escape(str(value), _ATTRIB_ENTITIES))
+
+
+class GraphMLWriter:
+    """Writes out a dynamic network to graphml format, one relation at a time
+
+    Produces the same graph as nx.write_graphml on the multigraph returned by
+    network_processing.narrative_smoothing (weight in key "d0", episode in key "d1", scene
+    index as edge id), up to the order of the edges and of their endpoints, without holding
+    the edges in memory.
+
+    Args:
+    path     (str):  output file name (gzip-compressed if ending with .gz)
+    nodes    (list): speakers, written out before any edge
+    compress (bool): gzip-compress the output regardless of the file name
+    """
+
+    def __init__(self, path, nodes, compress=False):
+        if compress or path.endswith('.gz'):
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+
+        self._file.write(_GRAPHML_HEADER)
+        for node in nodes:
+            self._file.write('    <node id={} />\n'.format(_quote_attrib(node)))
+
+        self.number_of_edges = 0
+
+    def write_relation(self, fSpk, sSpk, scene_indices, weights, scene_mapping):
+        """Writes out the edges of a relation
+        Args:
+        fSpk          (str):        first speaker
+        sSpk          (str):        second speaker
+        scene_indices (np.ndarray): scenes in which the relation is weighted
+        weights       (np.ndarray): interpolated weight of the relation in these scenes
+        scene_mapping (list):       episode id of each scene
+
+        Returns:
+        None
+        """
+
+        source, target = _quote_attrib(fSpk), _quote_attrib(sSpk)
+
+        self._file.write(''.join(_GRAPHML_EDGE.format(source, target, scene_idx, repr(float(weight)), escape(scene_mapping[scene_idx]))
+                                 for scene_idx, weight in zip(scene_indices.tolist(), weights)))
+
+        self.number_of_edges += len(scene_indices)
+
+    def close(self):
+        self._file.write(_GRAPHML_FOOTER)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream_to_graphml(smoothed_relations, nodes, scene_mapping, path, compress=False):
+    """Writes out the relations of a dynamic network to graphml format as they are generated
+    Args:
+    smoothed_relations (iterable): (fSpk, sSpk, scene_indices, weights) of every relation
+    nodes              (list):     speakers, in order of appearance
+    scene_mapping      (list):     episode id of each scene
+    path               (str):      output file name (gzip-compressed if ending with .gz)
+    compress           (bool):     gzip-compress the output regardless of the file name
+
+    Returns:
+    n_edges            (int):      number of edges written out
+    """
+
+    with GraphMLWriter(path, nodes, compress=compress) as writer:
+        for fSpk, sSpk, scene_indices, weights in smoothed_relations:
+            writer.write_relation(fSpk, sSpk, scene_indices, weights, scene_mapping)
+
+    return writer.number_of_edges
+
+
+def _binary_columns(S):
+    """Columnar layout of a compact dynamic network
+    Args:
+    S       (DynamicNetwork): compact dynamic network
+
+    Returns:
+    columns (dict):           edge columns (source, target, scene, weight), and separate relation, node and episode tables
+    """
+
+    nodes = S.nodes
+    node_idx = {spk: i for i, spk in enumerate(nodes)}
+
+    # node ids of every relation, repeated over its edges
+    n_edges = np.diff(S.indptr)
+    sources = np.array([node_idx[fSpk] for fSpk, _ in S.relations], dtype=np.int32)
+    targets = np.array([node_idx[sSpk] for _, sSpk in S.relations], dtype=np.int32)
+
+    return {'source': np.repeat(sources, n_edges),
+            'target': np.repeat(targets, n_edges),
+            'scene': S.scenes,
+            'weight': S.weights,
+            'indptr': S.indptr,
+            'relation_source': sources,
+            'relation_target': targets,
+            'nodes': np.array(nodes, dtype=str),
+            'episodes': np.array(S.episodes, dtype=str),
+            'scene_episode': S.scene_episode}
+
+
+def export_to_binary_format(S, path):
+    """Writes out a compact dynamic network to a columnar binary format
+
+    The format depends on the output path:
+    - .npz:      single NumPy archive
+    - .parquet:  Parquet edge table, with node and scene tables in <path>.nodes.parquet and
+                 <path>.scenes.parquet (requires pyarrow)
+    - otherwise: directory of .npy files, one per column, memory-mappable with np.load(mmap_mode='r')
+
+    Args:
+    S    (DynamicNetwork): compact dynamic network
+    path (str):            output file or directory name
+
+    Returns:
+    None
+    """
+
+    columns = _binary_columns(S)
+
+    if path.endswith('.npz'):
+        np.savez(path, **columns)
+
+    elif path.endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Parquet output requires pyarrow (pip install pyarrow)')
+
+        pq.write_table(pa.table({name: columns[name] for name in ('source', 'target', 'scene', 'weight')}), path)
+        pq.write_table(pa.table({'node': columns['nodes']}), path + '.nodes.parquet')
+        pq.write_table(pa.table({'episode': columns['episodes'][columns['scene_episode']]}), path + '.scenes.parquet')
+
+    else:
+        os.makedirs(path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(path, name + '.npy'), column)
+
+
+def load_binary_format(path, mmap_mode='r'):
+    """Loads a compact dynamic network written out by export_to_binary_format (.npz or .npy directory)
+    Args:
+    path      (str):            input file or directory name
+    mmap_mode (str):            memory-map mode of the .npy columns (ignored for .npz archives)
+
+    Returns:
+    S         (DynamicNetwork): compact dynamic network
+    """
+
+    if path.endswith('.npz'):
+        columns = np.load(path)
+    else:
+        columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                   for name in ('scene', 'weight', 'indptr', 'relation_source', 'relation_target', 'nodes', 'episodes', 'scene_episode')}
+
+    nodes = columns['nodes'].tolist()
+    relations = [(nodes[f], nodes[s]) for f, s in zip(columns['relation_source'].tolist(), columns['relation_target'].tolist())]
+
+    return DynamicNetwork(relations,
+                          columns['indptr'],
+                          columns['scene'],
+                          columns['weight'],
+                          columns['episodes'].tolist(),
+                          columns['scene_episode'])
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import network_processing
+
+from dynamic_network import DynamicNetwork, encode_scene_mapping
+
+
+def _trail_time(index, fSpk, sSpk, last_idx, n_scenes):
+    """Cumulative interaction time of two speakers with other characters after the last occurrence of their relation
+    Args:
+    index      (InteractionTimeIndex): interaction time of every speaker by scene
+    fSpk       (str):                  first speaker
+    sSpk       (str):                  second speaker
+    last_idx   (int):                  scene of the last occurrence of the relation
+    n_scenes   (int):                  number of scenes
+
+    Returns:
+    trail_time (float):                interaction time from the last occurrence to the last scene
+    """
+
+    after_time = index.scene_separation_time(fSpk, sSpk, last_idx + 1, n_scenes)
+
+    # cumulated in the same order as the narrative persistence
+    return np.cumsum(after_time)[-1] if after_time.shape[0] else 0.0
+
+
+class SmoothingState:
+    """State of the narrative smoothing of a series, updated when new episodes are appended
+
+    Attributes:
+    scene_mapping (list):           episode id of each scene
+    speakers      (list):           speakers
+    scene_time    (np.ndarray):     interaction time of every speaker in each scene, shape (n_speakers, n_scenes)
+    neighbors     (list):           interlocutors (speaker indices) of every speaker, in order of first interaction
+    last_idx      (np.ndarray):     scene of the last occurrence of every relation
+    last_weight   (np.ndarray):     interaction time of every relation at its last occurrence
+    trail_time    (np.ndarray):     interaction time with other characters since the last occurrence of every relation
+    S             (DynamicNetwork): dynamic network of interpolated interaction weight by scene
+    """
+
+    def __init__(self, scene_mapping, speakers, scene_time, neighbors, last_idx, last_weight, trail_time, S):
+        self.scene_mapping = list(scene_mapping)
+        self.speakers = list(speakers)
+        self.scene_time = scene_time
+        self.neighbors = [list(nbrs) for nbrs in neighbors]
+        self.last_idx = np.asarray(last_idx, dtype=np.int64)
+        self.last_weight = np.asarray(last_weight, dtype=np.float64)
+        self.trail_time = np.asarray(trail_time, dtype=np.float64)
+        self.S = S
+
+    @classmethod
+    def from_network(cls, R, scene_mapping, S, index=None):
+        """Records the state of a complete narrative smoothing
+        Args:
+        R             (InteractionNetwork):   interaction time by scene
+        scene_mapping (list):                 episode id of each scene
+        S             (DynamicNetwork):       compact dynamic network returned by network_processing.narrative_smoothing
+        index         (InteractionTimeIndex): interaction time of every speaker by scene (built from R if None)
+
+        Returns:
+        state         (SmoothingState):       smoothing state
+        """
+
+        n_scenes = len(scene_mapping)
+
+        if index is None:
+            index = network_processing.InteractionTimeIndex(R, n_scenes)
+
+        speakers = list(index.speakers)
+        neighbors = [[index.speakers[nbr] for nbr in R.neighbors(spk)] for spk in speakers]
+
+        last_idx = []
+        last_weight = []
+        trail_time = []
+        for fSpk, sSpk in S.relations:
+            scene_indices, weights = R.edges(fSpk, sSpk)
+            scene_idx = int(scene_indices[-1])
+            last_idx.append(scene_idx)
+            last_weight.append(weights[-1])
+            trail_time.append(_trail_time(index, fSpk, sSpk, scene_idx, n_scenes))
+
+        return cls(scene_mapping, speakers, index.scene_time, neighbors, last_idx, last_weight, trail_time, S)
+
+    def update(self, scene_speech_turns, scene_mapping):
+        """Appends new scenes and updates the dynamic network accordingly
+
+        Only the relations occurring in the new scenes are recomputed, from their last previous
+        occurrence on; the tails of the other relations are extended from their trailing
+        interaction time. The result is identical to the narrative smoothing of the whole series.
+
+        Args:
+        scene_speech_turns (SpeechTurns):    columnar speech turns with interlocutors, as distributed over the new scenes
+        scene_mapping      (list):           episode id of each new scene
+
+        Returns:
+        S                  (DynamicNetwork): updated dynamic network of interpolated interaction weight by scene
+        """
+
+        n_prev_scenes = len(self.scene_mapping)
+        n_scenes = n_prev_scenes + len(scene_mapping)
+
+        if n_scenes == n_prev_scenes:
+            return self.S
+
+        # raw interaction time in the new scenes
+        R = network_processing.build_interaction_network(scene_speech_turns, first_scene=n_prev_scenes)
+
+        # new speakers and interlocutors, in order of first interaction
+        speaker_idx = {spk: i for i, spk in enumerate(self.speakers)}
+        for spk in R.nodes:
+            if spk not in speaker_idx:
+                speaker_idx[spk] = len(self.speakers)
+                self.speakers.append(spk)
+                self.neighbors.append([])
+
+        for spk in R.nodes:
+            neighbors = self.neighbors[speaker_idx[spk]]
+            known = set(neighbors)
+            neighbors += [speaker_idx[nbr] for nbr in R.neighbors(spk) if speaker_idx[nbr] not in known]
+
+        # interaction time of every speaker in the new scenes, summed in the order of the whole interaction network
+        scene_time = np.zeros((len(self.speakers), n_scenes))
+        scene_time[:self.scene_time.shape[0], :n_prev_scenes] = self.scene_time
+
+        for spk in R.nodes:
+            times = {}
+            for nbr in self.neighbors[speaker_idx[spk]]:
+                scene_indices, weights = R.edges(spk, self.speakers[nbr])
+                for scene_idx, weight in zip(scene_indices.tolist(), weights.tolist()):
+                    times.setdefault(scene_idx, []).append(weight)
+
+            for scene_idx, weights in times.items():
+                scene_time[speaker_idx[spk], scene_idx] = np.sum(weights)
+
+        index = network_processing.InteractionTimeIndex.from_scene_time(speaker_idx, scene_time)
+
+        # previous and new relations, in the order they are smoothed
+        prev_relations = {relation: i for i, relation in enumerate(self.S.relations)}
+        relations = sorted(set(prev_relations) | set(network_processing._relations(R)))
+
+        scenes = []
+        weights = []
+        last_idx = np.empty(len(relations), dtype=np.int64)
+        last_weight = np.empty(len(relations))
+        trail_time = np.empty(len(relations))
+
+        for p, (fSpk, sSpk) in enumerate(relations):
+            i = prev_relations.get((fSpk, sSpk))
+            occ_scenes, occ_times = R.edges(fSpk, sSpk)
+            occ_scenes, occ_times = occ_scenes.tolist(), occ_times.tolist()
+
+            if i is None:
+                # new relation
+                occ_indices = occ_scenes
+                occ_weights = occ_times
+                new_scenes, raw = network_processing._smooth_relation(fSpk, sSpk, occ_indices, occ_weights, index, n_scenes)
+                prev_scenes, prev_weights = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+            elif occ_scenes:
+                # reappearing relation: recompute from its last previous occurrence on
+                occ_indices = [self.last_idx[i]] + occ_scenes
+                occ_weights = [self.last_weight[i]] + occ_times
+                new_scenes, raw = network_processing._smooth_relation(fSpk, sSpk, occ_indices, occ_weights, index, n_scenes, before=False)
+                prev_scenes, prev_weights = self.S.relation(i)
+                prev_scenes, prev_weights = prev_scenes[prev_scenes < self.last_idx[i]], prev_weights[prev_scenes < self.last_idx[i]]
+
+            else:
+                # extend the narrative persistence after the last occurrence
+                occ_indices = [self.last_idx[i]]
+                occ_weights = [self.last_weight[i]]
+                prev_scenes, prev_weights = self.S.relation(i)
+
+                new_time = index.scene_separation_time(fSpk, sSpk, n_prev_scenes, n_scenes)
+                cum_from_last = np.cumsum(np.concatenate([[self.trail_time[i]], new_time]))[1:]
+
+                if np.any(new_time):
+                    # last scene in which (at least) one of the two characters interacted with others
+                    last_occ_idx = new_time.shape[0] - np.argmax(np.flip(new_time) > 0) - 1
+
+                    # no interaction with others since the previous tail
+                    n_idle = n_prev_scenes - prev_scenes[-1] - 1
+
+                    new_scenes = np.arange(prev_scenes[-1] + 1, n_prev_scenes + last_occ_idx + 1)
+                    raw = np.concatenate([np.full(n_idle, self.last_weight[i] - self.trail_time[i]),
+                                          self.last_weight[i] - cum_from_last[:last_occ_idx + 1]])
+                else:
+                    new_scenes, raw = np.empty(0, dtype=np.int32), np.empty(0)
+
+                trail_time[p] = cum_from_last[-1]
+
+            scenes += [prev_scenes, new_scenes]
+            weights += [prev_weights, network_processing._sigmoid(raw)]
+            last_idx[p] = occ_indices[-1]
+            last_weight[p] = occ_weights[-1]
+            if i is None or occ_scenes:
+                trail_time[p] = _trail_time(index, fSpk, sSpk, last_idx[p], n_scenes)
+
+        self.scene_mapping += scene_mapping
+        self.scene_time = scene_time
+        self.last_idx = last_idx
+        self.last_weight = last_weight
+        self.trail_time = trail_time
+
+        episodes, scene_episode = encode_scene_mapping(self.scene_mapping)
+        self.S = DynamicNetwork(relations,
+                                np.concatenate([[0], np.cumsum([len(scenes[2*p]) + len(scenes[2*p+1]) for p in range(len(relations))])]),
+                                np.concatenate(scenes) if scenes else np.empty(0, dtype=np.int32),
+                                np.concatenate(weights) if weights else np.empty(0, dtype=np.float32),
+                                episodes,
+                                scene_episode)
+
+        return self.S
+
+    def save(self, path):
+        """Writes out the smoothing state to a .npz archive
+        Args:
+        path (str): output file name
+
+        Returns:
+        None
+        """
+
+        speaker_idx = {spk: i for i, spk in enumerate(self.speakers)}
+
+        np.savez(path,
+                 scene_mapping=np.array(self.scene_mapping, dtype=str),
+                 speakers=np.array(self.speakers, dtype=str),
+                 scene_time=self.scene_time,
+                 neighbor_indptr=np.cumsum([0] + [len(nbrs) for nbrs in self.neighbors]),
+                 neighbor_ids=np.array([nbr for nbrs in self.neighbors for nbr in nbrs], dtype=np.int64),
+                 relation_source=np.array([speaker_idx[fSpk] for fSpk, _ in self.S.relations], dtype=np.int64),
+                 relation_target=np.array([speaker_idx[sSpk] for _, sSpk in self.S.relations], dtype=np.int64),
+                 last_idx=self.last_idx,
+                 last_weight=self.last_weight,
+                 trail_time=self.trail_time,
+                 indptr=self.S.indptr,
+                 scenes=self.S.scenes,
+                 weights=self.S.weights)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a smoothing state written out by SmoothingState.save
+        Args:
+        path  (str):            input file name
+
+        Returns:
+        state (SmoothingState): smoothing state
+        """
+
+        with np.load(path) as data:
+            scene_mapping = data['scene_mapping'].tolist()
+            speakers = data['speakers'].tolist()
+            neighbor_indptr = data['neighbor_indptr']
+            neighbor_ids = data['neighbor_ids'].tolist()
+            neighbors = [neighbor_ids[neighbor_indptr[i]:neighbor_indptr[i+1]] for i in range(len(speakers))]
+            relations = [(speakers[f], speakers[s]) for f, s in zip(data['relation_source'].tolist(), data['relation_target'].tolist())]
+
+            episodes, scene_episode = encode_scene_mapping(scene_mapping)
+            S = DynamicNetwork(relations, data['indptr'], data['scenes'], data['weights'], episodes, scene_episode)
+
+            return cls(scene_mapping,
+                       speakers,
+                       data['scene_time'],
+                       neighbors,
+                       data['last_idx'],
+                       data['last_weight'],
+                       data['trail_time'],
+                       S)
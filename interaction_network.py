@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class InteractionNetwork:
+    """Dynamic network of speaker interaction time in each scene, as sparse (pair, scene) arrays
+
+    Speakers and pairs of speakers are numbered in order of first interaction, as the nodes and
+    adjacencies of the equivalent nx.MultiGraph. The interaction time of the p-th pair is given
+    in scenes[indptr[p]:indptr[p+1]], in increasing order, and weights[indptr[p]:indptr[p+1]].
+
+    Args:
+    nodes       (list):       speakers, in order of first interaction
+    pair_source (np.ndarray): node id of the first speaker of every pair
+    pair_target (np.ndarray): node id of the second speaker of every pair
+    indptr      (np.ndarray): offsets of every pair into scenes and weights, shape (n_pairs+1,)
+    scenes      (np.ndarray): scenes in which every pair interacts
+    weights     (np.ndarray): interaction time of every pair in these scenes
+    """
+
+    def __init__(self, nodes, pair_source, pair_target, indptr, scenes, weights):
+        self.nodes = list(nodes)
+        self.pair_source = np.asarray(pair_source, dtype=np.int64)
+        self.pair_target = np.asarray(pair_target, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.scenes = np.asarray(scenes, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+        self._node_idx = {spk: i for i, spk in enumerate(self.nodes)}
+        self._pair_idx = {}
+        for p, (f, s) in enumerate(zip(self.pair_source.tolist(), self.pair_target.tolist())):
+            self._pair_idx[f, s] = p
+            self._pair_idx[s, f] = p
+        self._neighbors = None
+        self._scene_order = None
+
+    @classmethod
+    def from_speech_turns(cls, speech_turns, first_scene=0):
+        """Accumulates the interaction time of every pair of speakers in each scene, in a single pass
+        Args:
+        speech_turns (SpeechTurns):        columnar speech turns with interlocutors, as distributed over scenes
+        first_scene  (int):                index of the first scene
+
+        Returns:
+        R            (InteractionNetwork): interaction time by scene
+        """
+
+        # one interaction per (speech turn, interlocutor), unknown speakers left out
+        n_interlocs = np.diff(speech_turns.interloc_indptr)
+        turn = np.repeat(np.arange(len(speech_turns)), n_interlocs)
+        spk = speech_turns.speaker[turn].astype(np.int64)
+        interloc = speech_turns.interloc_ids.astype(np.int64)
+
+        known = np.array([name != 'unknown' for name in speech_turns.names], dtype=bool)
+        valid = known[spk] & known[interloc]
+        turn, spk, interloc = turn[valid], spk[valid], interloc[valid]
+
+        duration = (speech_turns.end - speech_turns.start)[turn]
+        scene = np.repeat(np.arange(first_scene, first_scene + speech_turns.n_scenes),
+                          np.diff(speech_turns.scene_offsets))[turn]
+
+        # speakers, in order of first interaction
+        endpoints = np.stack([spk, interloc], axis=1).ravel()
+        names, first_pos = np.unique(endpoints, return_index=True)
+        names = names[np.argsort(first_pos, kind='stable')]
+        node_id = np.empty(len(speech_turns.names), dtype=np.int64)
+        node_id[names] = np.arange(names.shape[0])
+        spk, interloc = node_id[spk], node_id[interloc]
+
+        # pairs of speakers, in order of first interaction
+        n_nodes = max(names.shape[0], 1)
+        pair_key = np.minimum(spk, interloc) * n_nodes + np.maximum(spk, interloc)
+        keys, first_pos, pair_inv = np.unique(pair_key, return_index=True, return_inverse=True)
+        order = np.argsort(first_pos, kind='stable')
+        pair_id = np.empty(keys.shape[0], dtype=np.int64)
+        pair_id[order] = np.arange(keys.shape[0])
+        pair = pair_id[pair_inv.ravel()]
+
+        # interaction time of every (pair, scene), summed in the order of the speech turns
+        n_scenes = max(first_scene + speech_turns.n_scenes, 1)
+        cells, cell_inv = np.unique(pair * n_scenes + scene, return_inverse=True)
+        weights = np.bincount(cell_inv.ravel(), weights=duration, minlength=cells.shape[0])
+        cell_pair = cells // n_scenes
+
+        return cls([speech_turns.names[name] for name in names.tolist()],
+                   spk[first_pos[order]],
+                   interloc[first_pos[order]],
+                   np.searchsorted(cell_pair, np.arange(keys.shape[0] + 1)),
+                   cells - cell_pair * n_scenes,
+                   weights)
+
+    def number_of_pairs(self):
+        """Number of pairs of interacting speakers"""
+
+        return self.pair_source.shape[0]
+
+    def number_of_relations(self):
+        """Number of relations smoothed, i.e. pairs of distinct interacting speakers"""
+
+        return int(np.count_nonzero(self.pair_source != self.pair_target))
+
+    def neighbors(self, spk):
+        """Interlocutors of a speaker, in order of first interaction
+        Args:
+        spk       (str):  speaker
+
+        Returns:
+        neighbors (list): interlocutors
+        """
+
+        if self._neighbors is None:
+            self._neighbors = [[] for _ in self.nodes]
+            for f, s in zip(self.pair_source.tolist(), self.pair_target.tolist()):
+                self._neighbors[f].append(self.nodes[s])
+                if s != f:
+                    self._neighbors[s].append(self.nodes[f])
+
+        return self._neighbors[self._node_idx[spk]]
+
+    def has_edge(self, fSpk, sSpk):
+        """Tests if two speakers interact in at least one scene"""
+
+        f, s = self._node_idx.get(fSpk), self._node_idx.get(sSpk)
+
+        return (f, s) in self._pair_idx
+
+    def edges(self, fSpk, sSpk):
+        """Interaction time of two speakers in every scene in which they interact
+        Args:
+        fSpk    (str):        first speaker
+        sSpk    (str):        second speaker
+
+        Returns:
+        scenes  (np.ndarray): scenes in which the speakers interact, in increasing order (empty if none)
+        weights (np.ndarray): interaction time in these scenes
+        """
+
+        p = self._pair_idx.get((self._node_idx.get(fSpk), self._node_idx.get(sSpk)))
+        if p is None:
+            return self.scenes[:0], self.weights[:0]
+
+        return self.scenes[self.indptr[p]:self.indptr[p+1]], self.weights[self.indptr[p]:self.indptr[p+1]]
+
+    def scene_edges(self, start, stop):
+        """Interaction time of every pair in a range of scenes
+        Args:
+        start   (int):        first scene index (inclusive)
+        stop    (int):        last scene index (exclusive)
+
+        Returns:
+        pairs   (np.ndarray): pair of every edge within the range, in increasing order
+        scenes  (np.ndarray): scene of these edges, in increasing order for every pair
+        weights (np.ndarray): interaction time of these edges
+        """
+
+        # edges sorted by scene, for ranges of scenes to be looked up without scanning every edge
+        if self._scene_order is None:
+            self._scene_order = np.argsort(self.scenes, kind='stable')
+            self._sorted_scenes = self.scenes[self._scene_order]
+            self._edge_pair = np.repeat(np.arange(self.number_of_pairs()), np.diff(self.indptr))
+
+        lo, hi = np.searchsorted(self._sorted_scenes, [start, stop])
+        edges = np.sort(self._scene_order[lo:hi])
+
+        return self._edge_pair[edges], self.scenes[edges], self.weights[edges]
+
+    def speaker_time(self, n_scenes, start=0):
+        """Total interaction time of every speaker in each scene
+        Args:
+        n_scenes   (int):        number of scenes
+        start      (int):        first scene index
+
+        Returns:
+        scene_time (np.ndarray): interaction time of every speaker in each scene from start, shape (n_speakers, n_scenes)
+        """
+
+        pair, scenes, weights = self.scene_edges(start, start + n_scenes)
+        n_edges = scenes.shape[0]
+        scenes = scenes - start
+        source, target = self.pair_source[pair], self.pair_target[pair]
+        loop = source == target
+
+        # every edge counts for both speakers (once for self-interactions)
+        row = np.concatenate([source, target[~loop]])
+        scene = np.concatenate([scenes, scenes[~loop]])
+        weight = np.concatenate([weights, weights[~loop]])
+        pair = np.concatenate([pair, pair[~loop]])
+
+        # summed in the order of the adjacencies of every speaker, i.e. of first interaction
+        order = np.lexsort((pair, scene, row))
+        cell = row[order] * n_scenes + scene[order]
+        weight = weight[order]
+
+        scene_time = np.zeros((len(self.nodes), n_scenes))
+        if not n_edges:
+            return scene_time
+
+        starts = np.flatnonzero(np.concatenate([[True], cell[1:] != cell[:-1]]))
+        sizes = np.diff(np.append(starts, cell.shape[0]))
+        group = np.repeat(np.arange(starts.shape[0]), sizes)
+        totals = np.bincount(group, weights=weight)
+
+        # np.sum only adds sequentially up to 8 items
+        for g in np.flatnonzero(sizes >= 8).tolist():
+            totals[g] = np.sum(weight[starts[g]:starts[g] + sizes[g]])
+
+        scene_time.ravel()[cell[starts]] = totals
+
+        return scene_time
+
+    def to_networkx(self):
+        """Converts the interaction network to an undirected, weighted multigraph of interaction time by scene
+
+        Returns:
+        G (nx.MultiGraph): interaction time by scene, the scene index being the key of every edge
+        """
+
+        import networkx as nx
+
+        G = nx.MultiGraph()
+        G.add_nodes_from(self.nodes)
+
+        scenes, weights = self.scenes.tolist(), self.weights.tolist()
+        for p, (f, s) in enumerate(zip(self.pair_source.tolist(), self.pair_target.tolist())):
+            for k in range(self.indptr[p], self.indptr[p+1]):
+                G.add_edge(self.nodes[f], self.nodes[s], key=scenes[k], weight=weights[k])
+
+        return G
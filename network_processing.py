@@ -1,214 +1,967 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import networkx as nx
+import multiprocessing
+
 import numpy as np
 
+from dynamic_network import DynamicNetwork
+from graph_io import stream_to_graphml
+from interaction_network import InteractionNetwork
+from speech_turns import SpeechTurns
+
 
-def build_interaction_network(scene_speech_turns):
+def build_interaction_network(scene_speech_turns, first_scene=0):
     """Builds the dynamic network of speaker interaction time in each scene
     Args:
-    scene_speech_turns (dict)         : speech turns with interlocutors, as distributed over scenes
+    scene_speech_turns (SpeechTurns or list): speech turns with interlocutors, as distributed over scenes
+    first_scene        (int)                : index of the first scene
 
     Returns:
-    G                  (nx.MultiGraph): undirected, weighted multigraph of interaction time by scene
+    R                  (InteractionNetwork) : interaction time by scene (see InteractionNetwork.to_networkx for the multigraph)
     """
-    
-    G = nx.MultiGraph()
 
-    for i, speech_turns in enumerate(scene_speech_turns):
+    if not isinstance(scene_speech_turns, SpeechTurns):
+        scene_speech_turns = SpeechTurns.from_scene_speech_turns(scene_speech_turns)
+
+    return InteractionNetwork.from_speech_turns(scene_speech_turns, first_scene)
+
+
+class InteractionTimeIndex:
+    """Total interaction time of every speaker in each scene
+
+    Built in a single pass over the edges of the interaction network, so that the interaction
+    time of two speakers with other characters over any range of scenes can be looked up
+    without rescanning the network.
+
+    Args:
+    R          (InteractionNetwork): interaction time by scene
+    n_scenes   (int):                number of scenes
+
+    Attributes:
+    speakers   (dict):               row index of every speaker
+    scene_time (np.ndarray):         interaction time of every speaker in each scene, shape (n_speakers, n_scenes)
+    """
+
+    def __init__(self, R, n_scenes):
+        self.speakers = {spk: row for row, spk in enumerate(R.nodes)}
+        self.scene_time = R.speaker_time(n_scenes)
+
+    @classmethod
+    def from_scene_time(cls, speakers, scene_time):
+        """Builds the index from precomputed interaction time
+        Args:
+        speakers   (dict):                 row index of every speaker
+        scene_time (np.ndarray):           interaction time of every speaker in each scene, shape (n_speakers, n_scenes)
+
+        Returns:
+        index      (InteractionTimeIndex): interaction time of every speaker by scene
+        """
+
+        index = cls.__new__(cls)
+        index.speakers = speakers
+        index.scene_time = scene_time
+
+        return index
 
-        for speech_turn in speech_turns:
-            spk = speech_turn['speaker']
-            duration = speech_turn['end'] - speech_turn['start']
-                
-            for interloc in speech_turn['interlocutors']:
-                if not (spk == 'unknown' or interloc == 'unknown'): 
-                    # initialize edge
-                    if not G.has_edge(spk, interloc, key=i):
-                        G.add_edge(spk, interloc, key=i, weight=0.0)
+    def scene_separation_time(self, fSpk, sSpk, start, stop):
+        """Interaction time of two speakers with other characters in each scene of a range
+        Args:
+        fSpk     (str):        first speaker
+        sSpk     (str):        second speaker
+        start    (int):        first scene index (inclusive)
+        stop     (int):        last scene index (exclusive)
 
-                    # update weight
-                    prev_weight = G[spk][interloc][i]['weight']
-                    G.add_edge(spk, interloc, key=i, weight=(prev_weight+duration))
-                 
-    return G
+        Returns:
+        sep_time (np.ndarray): interaction time in every scene of the range
+        """
+
+        return self.scene_time[self.speakers[fSpk], start:stop] + self.scene_time[self.speakers[sSpk], start:stop]
 
 
 def _sigmoid(x, mu=0.01):
     """Evaluates the parameterized sigmoid function of x as 1 / (1 + exp(-mu * x))
     Args:
-    x   (float): input number
+    x   (float or np.ndarray): input number(s)
+    mu  (float):               steepness of the sigmoid
 
     Returns:
-    sig (float): sigmoid mapping
+    sig (float or np.ndarray): sigmoid mapping, rounded to 4 decimals
     """
 
     sig = 1 / (1 + np.exp(-mu * x))
 
-    return round(sig, 4)
+    return np.round(sig, 4)
+
+
+def _min_raw_weight(min_weight, mu=0.01):
+    """Smallest relation weight before sigmoid mapping to be mapped to at least min_weight
+    Args:
+    min_weight (float): minimum weight, after sigmoid mapping
+    mu         (float): steepness of the sigmoid
+
+    Returns:
+    min_raw    (float): minimum weight, before sigmoid mapping (-inf or inf if any or no weight is mapped to at least min_weight)
+    """
+
+    lo, hi = -50.0 / mu, 50.0 / mu
+    if _sigmoid(lo, mu) >= min_weight:
+        return -np.inf
+    if _sigmoid(hi, mu) < min_weight:
+        return np.inf
+
+    # the sigmoid mapping is monotonic: bisect down to consecutive floats
+    while True:
+        mid = (lo + hi) / 2
+        if mid == lo or mid == hi:
+            return hi
+        if _sigmoid(mid, mu) >= min_weight:
+            hi = mid
+        else:
+            lo = mid
+
+
+def _relations(R):
+    """Lists the pairs of interacting speakers, in the order they are smoothed
+    Args:
+    R         (InteractionNetwork): interaction time by scene
+
+    Returns:
+    relations (list):               (first speaker, second speaker) tuples
+    """
+
+    nodes = sorted(R.nodes)
+    rank = {spk: i for i, spk in enumerate(nodes)}
+
+    relations = []
+    for fSpk in nodes:
+        for sSpk in sorted((spk for spk in R.neighbors(fSpk) if rank[spk] > rank[fSpk]), key=rank.get):
+            relations.append((fSpk, sSpk))
+
+    return relations
+
+
+def _raw_relation_weights(R, relations, index, n_scenes):
+    """Computes the weight of a batch of relations in every scene, before sigmoid mapping
+    Args:
+    R         (InteractionNetwork):   interaction time by scene
+    relations (list):                 (first speaker, second speaker) tuples
+    index     (InteractionTimeIndex): interaction time of every speaker by scene
+    n_scenes  (int):                  number of scenes
+
+    Returns:
+    raw       (np.ndarray):           interaction time, narrative persistence or anticipation, shape (n_relations, n_scenes)
+    active    (np.ndarray):           mask of the scenes in which every relation is weighted, shape (n_relations, n_scenes)
+    """
+
+    n_relations = len(relations)
+    rows = np.arange(n_relations)[:, None]
+    scenes = np.arange(n_scenes)
+
+    # occurrences of every relation
+    occ = np.zeros((n_relations, n_scenes), dtype=bool)
+    occ_weight = np.zeros((n_relations, n_scenes))
+    for p, (fSpk, sSpk) in enumerate(relations):
+        scene_indices, weights = R.edges(fSpk, sSpk)
+        occ[p, scene_indices] = True
+        occ_weight[p, scene_indices] = weights
+
+    # interaction time with other characters in every scene, and its cumulative sum
+    f_rows = [index.speakers[fSpk] for fSpk, _ in relations]
+    s_rows = [index.speakers[sSpk] for _, sSpk in relations]
+    sep_time = index.scene_time[f_rows] + index.scene_time[s_rows]
+    cum_time = np.zeros((n_relations, n_scenes + 1))
+    np.cumsum(sep_time, axis=1, out=cum_time[:, 1:])
+
+    # last and next occurrences of every relation in each scene
+    last_idx = np.maximum.accumulate(np.where(occ, scenes, -1), axis=1)
+    next_idx = np.flip(np.minimum.accumulate(np.flip(np.where(occ, scenes, n_scenes), axis=1), axis=1), axis=1)
+    has_last = last_idx >= 0
+    has_next = next_idx < n_scenes
+    last_idx = np.maximum(last_idx, 0)
+    next_idx = np.minimum(next_idx, n_scenes - 1)
+
+    # narrative persistence of the last occurrence of the relation
+    narr_persist = occ_weight[rows, last_idx] - (cum_time[:, 1:] - cum_time[rows, last_idx + 1])
+
+    # narrative anticipation on the next occurrence of the relation
+    narr_anticip = occ_weight[rows, next_idx] - (cum_time[rows, next_idx] - cum_time[:, :-1])
+
+    raw = np.where(has_last & has_next,
+                   np.maximum(narr_persist, narr_anticip),
+                   np.where(has_last, narr_persist, narr_anticip))
+    raw[occ] = occ_weight[occ]
+
+    # before the first occurrence: from the first scene in which either character interacted with others
+    interacting = sep_time > 0
+    before = ~has_last & np.logical_or.accumulate(~has_last & interacting, axis=1)
+
+    # after the last occurrence: up to the last scene in which either character interacted with others
+    after = ~has_next & np.flip(np.logical_or.accumulate(np.flip(~has_next & interacting, axis=1), axis=1), axis=1)
+
+    active = (has_last & has_next) | before | after
+
+    return raw, active
+
+
+def _vectorized_relations(R, scene_mapping, index, relations, batch_size=None, sigmoid=True, min_weight=None):
+    """Interpolates the weight of every relation in each scene, batches of relations at once
+    Args:
+    R             (InteractionNetwork):   interaction time by scene
+    scene_mapping (list):                 episode id of each scene
+    index         (InteractionTimeIndex): interaction time of every speaker by scene
+    relations     (list):                 (first speaker, second speaker) tuples
+    batch_size    (int):                  number of relations processed at once (bounded to ~1M cells if None)
+    sigmoid       (bool):                 map the weights with the sigmoid function (raw weights otherwise)
+    min_weight    (float):                leave out the scenes in which the relation is weighted less, after sigmoid mapping (none if None);
+                                          every scene of the batch is still processed
+
+    Yields:
+    fSpk          (str):                  first speaker
+    sSpk          (str):                  second speaker
+    scene_indices (np.ndarray):           scenes in which the relation is weighted, in increasing order
+    weights       (np.ndarray):           interpolated weight of the relation in these scenes
+    """
+
+    n_scenes = len(scene_mapping)
+
+    if batch_size is None:
+        batch_size = max(1, 2**20 // max(1, n_scenes))
+
+    if min_weight is not None:
+        min_raw = _min_raw_weight(min_weight)
+
+    for b in range(0, len(relations), batch_size):
+        batch = relations[b:b+batch_size]
+
+        raw, active = _raw_relation_weights(R, batch, index, n_scenes)
+
+        # every scene of the batch is weighted: the scenes weighted less are only masked out
+        if min_weight is not None:
+            active &= raw >= min_raw
+
+        rows, cols = np.nonzero(active)
+        raw = raw[rows, cols]
+
+        weights = _sigmoid(raw) if sigmoid else raw
+        offsets = np.searchsorted(rows, np.arange(len(batch) + 1))
+
+        for p, (fSpk, sSpk) in enumerate(batch):
+            start, stop = offsets[p], offsets[p+1]
+            yield fSpk, sSpk, cols[start:stop], weights[start:stop]
+
+
+def _smooth_relation(fSpk, sSpk, scene_indices, occ_weights, index, n_scenes, before=True):
+    """Interpolates the weight of a relation in each scene, before sigmoid mapping
+    Args:
+    fSpk          (str):                  first speaker
+    sSpk          (str):                  second speaker
+    scene_indices (list):                 scenes in which the relation occurs, in increasing order
+    occ_weights   (list):                 interaction time of the relation in these scenes
+    index         (InteractionTimeIndex): interaction time of every speaker by scene
+    n_scenes      (int):                  number of scenes
+    before        (bool):                 interpolate the relation weight before its first occurrence
+
+    Returns:
+    scene_indices (np.ndarray):           scenes in which the relation is weighted, in increasing order
+    raw           (np.ndarray):           interaction time, narrative persistence or anticipation in these scenes
+    """
+
+    keys = []
+    raw = []
+
+    ###################################################
+    # compute relation weight before first occurrence #
+    ###################################################
+
+    # interaction time with other characters in every scene
+    before_time = index.scene_separation_time(fSpk, sSpk, 0, scene_indices[0]) if before else np.array([])
+
+    # either character has interacted with others before the first occurrence of the relationship
+    if np.any(before_time):
+        # first scene in which (at least) one of the two characters interacted with others
+        first_occ_idx = np.argmax(before_time > 0)
+
+        # narrative anticipation on the next occurrence of the relation
+        cum_from_next = np.flip(np.cumsum(np.flip(before_time)))
+        narr_anticip = occ_weights[0] - cum_from_next
+
+        keys.append(np.arange(first_occ_idx, scene_indices[0]))
+        raw.append(narr_anticip[first_occ_idx:])
+
+    ###############################################################
+    # compute relation weight between two consecutive occurrences #
+    ###############################################################
+
+    for k in range(len(scene_indices)):
+
+        # index of last occurrence
+        last_idx = scene_indices[k]
+
+        # last occurrence
+        keys.append([last_idx])
+        raw.append([occ_weights[k]])
+
+        if k < len(scene_indices) - 1:
+            # index of next occurrence if any
+            next_idx = scene_indices[k+1]
+
+            # interaction time with other characters in-between
+            sep_time = index.scene_separation_time(fSpk, sSpk, last_idx+1, next_idx)
+
+            cum_from_last = np.cumsum(sep_time)
+            cum_from_next = np.flip(np.cumsum(np.flip(sep_time)))
+
+            # narrative persistence of the last occurrence of the relation
+            narr_persist = occ_weights[k] - cum_from_last
+
+            # narrative anticipation on the next occurrence of the relation
+            narr_anticip = occ_weights[k+1] - cum_from_next
+
+            # weights of the relationship between the last and next occurrences
+            keys.append(np.arange(last_idx+1, next_idx))
+            raw.append(np.max(np.array([narr_persist, narr_anticip]), axis=0))
+
+    #################################################
+    # compute relation weight after last occurrence #
+    #################################################
+
+    # interaction time with other characters in every scene
+    after_time = index.scene_separation_time(fSpk, sSpk, scene_indices[-1] + 1, n_scenes)
+
+    # either character has interacted with others after the last occurrence of the relationship
+    if np.any(after_time):
+
+        # last scene in which (at least) one of the two characters interacted with others
+        last_occ_idx = after_time.shape[0] - np.argmax(np.flip(after_time) > 0) - 1
+
+        # narrative persistence of the last occurrence of the relation
+        cum_from_last = np.cumsum(after_time)
+        narr_persist = occ_weights[-1] - cum_from_last
+
+        keys.append(np.arange(scene_indices[-1] + 1, scene_indices[-1] + last_occ_idx + 2))
+        raw.append(narr_persist[:last_occ_idx + 1])
+
+    return np.concatenate(keys).astype(int), np.concatenate(raw)
+
+
+def _weighted_span(occ_weight, fSpk, sSpk, index, start, stop, min_raw, backward=False, block_size=256):
+    """Narrative persistence of an occurrence over the following scenes, or anticipation over the preceding scenes, while weighted enough
+
+    The interaction time with other characters is only cumulated by blocks of increasing size,
+    up to the first scene in which the weight of the relation drops below min_raw: as the
+    persistence (anticipation) only decreases away from the occurrence, the remaining scenes
+    are skipped without being looked at.
+
+    Args:
+    occ_weight (float):                interaction time of the relation at the occurrence
+    fSpk       (str):                  first speaker
+    sSpk       (str):                  second speaker
+    index      (InteractionTimeIndex): interaction time of every speaker by scene
+    start      (int):                  first scene of the range (inclusive)
+    stop       (int):                  last scene of the range (exclusive)
+    min_raw    (float):                minimum weight of the relation, before sigmoid mapping
+    backward   (bool):                 anticipation over the last scenes of the range (persistence over the first ones otherwise)
+    block_size (int):                  size of the first block of scenes
+
+    Returns:
+    raw        (np.ndarray):           persistence (anticipation) in the first (last) scenes of the range weighted enough
+    sep_time   (np.ndarray):           interaction time with other characters in these scenes
+    """
+
+    raw = []
+    sep_time = []
+    carry = 0.0
+    pos = stop if backward else start
+
+    while (pos > start) if backward else (pos < stop):
+        if backward:
+            block = np.flip(index.scene_separation_time(fSpk, sSpk, max(start, pos - block_size), pos))
+        else:
+            block = index.scene_separation_time(fSpk, sSpk, pos, min(stop, pos + block_size))
+
+        # cumulated in the same order as over the whole range
+        cum = np.cumsum(np.concatenate([[carry], block]))[1:]
+        block_raw = occ_weight - cum
+
+        below = block_raw < min_raw
+        n = np.argmax(below) if np.any(below) else block.shape[0]
+        raw.append(block_raw[:n])
+        sep_time.append(block[:n])
+
+        if n < block.shape[0]:
+            break
+
+        carry = cum[-1]
+        pos = pos - n if backward else pos + n
+        block_size *= 2
+
+    raw = np.concatenate(raw) if raw else np.empty(0)
+    sep_time = np.concatenate(sep_time) if sep_time else np.empty(0)
+
+    if backward:
+        return np.flip(raw), np.flip(sep_time)
+
+    return raw, sep_time
+
+
+def _smooth_relation_above(fSpk, sSpk, scene_indices, occ_weights, index, n_scenes, min_raw, before=True, span_size=256):
+    """Interpolates the weight of a relation in the scenes in which it is at least min_raw, before sigmoid mapping
+
+    Same as _smooth_relation, the scenes weighted less than min_raw being left out. Over long
+    spans without occurrence of the relation, only the scenes weighted enough are processed.
+
+    Args:
+    fSpk          (str):                  first speaker
+    sSpk          (str):                  second speaker
+    scene_indices (list):                 scenes in which the relation occurs, in increasing order
+    occ_weights   (list):                 interaction time of the relation in these scenes
+    index         (InteractionTimeIndex): interaction time of every speaker by scene
+    n_scenes      (int):                  number of scenes
+    min_raw       (float):                minimum weight of the relation, before sigmoid mapping (see _min_raw_weight)
+    before        (bool):                 interpolate the relation weight before its first occurrence
+    span_size     (int):                  minimum number of scenes between two occurrences for the scenes weighted less to be skipped
+
+    Returns:
+    scene_indices (np.ndarray):           scenes in which the relation is weighted at least min_raw, in increasing order
+    raw           (np.ndarray):           interaction time, narrative persistence or anticipation in these scenes
+    """
+
+    keys = []
+    raw = []
+
+    def append(start, values):
+        keys.append(np.arange(start, start + values.shape[0]))
+        raw.append(values)
+
+    # before first occurrence: from the first scene in which either character interacted with others
+    if before:
+        first_idx = scene_indices[0]
+        narr_anticip, before_time = _weighted_span(occ_weights[0], fSpk, sSpk, index, 0, first_idx, min_raw, backward=True)
+        if narr_anticip.shape[0] == first_idx:
+            narr_anticip = narr_anticip[np.argmax(before_time > 0):] if np.any(before_time) else narr_anticip[:0]
+        append(first_idx - narr_anticip.shape[0], narr_anticip)
+
+    occ_weighted = (np.array(occ_weights) >= min_raw).tolist()
+
+    for k in range(len(scene_indices)):
+
+        # index of last occurrence
+        last_idx = scene_indices[k]
+
+        # last occurrence
+        if occ_weighted[k]:
+            append(last_idx, np.array([occ_weights[k]]))
 
+        if k < len(scene_indices) - 1:
+            # index of next occurrence if any
+            next_idx = scene_indices[k+1]
 
-def narrative_smoothing(R, scene_mapping):
+            if next_idx - last_idx - 1 > span_size:
+                narr_persist, _ = _weighted_span(occ_weights[k], fSpk, sSpk, index, last_idx+1, next_idx, min_raw)
+                narr_anticip, _ = _weighted_span(occ_weights[k+1], fSpk, sSpk, index, last_idx+1, next_idx, min_raw, backward=True)
+                skip = narr_persist.shape[0] + narr_anticip.shape[0] < next_idx - last_idx - 1
+            else:
+                skip = False
+
+            if skip:
+                # persistence and anticipation weighted enough in disjoint scenes
+                append(last_idx+1, narr_persist)
+                append(next_idx - narr_anticip.shape[0], narr_anticip)
+
+            elif next_idx > last_idx + 1:
+                # weights of the relationship between the last and next occurrences, as in _smooth_relation
+                sep_time = index.scene_separation_time(fSpk, sSpk, last_idx+1, next_idx)
+                narr_persist = occ_weights[k] - np.cumsum(sep_time)
+                narr_anticip = occ_weights[k+1] - np.flip(np.cumsum(np.flip(sep_time)))
+                gap_raw = np.max(np.array([narr_persist, narr_anticip]), axis=0)
+
+                weighted = gap_raw >= min_raw
+                keys.append(np.arange(last_idx+1, next_idx)[weighted])
+                raw.append(gap_raw[weighted])
+
+    # after last occurrence: up to the last scene in which either character interacted with others
+    last_idx = scene_indices[-1]
+    narr_persist, after_time = _weighted_span(occ_weights[-1], fSpk, sSpk, index, last_idx+1, n_scenes, min_raw)
+    if narr_persist.shape[0] == n_scenes - last_idx - 1:
+        narr_persist = narr_persist[:after_time.shape[0] - np.argmax(np.flip(after_time) > 0)] if np.any(after_time) else narr_persist[:0]
+    append(last_idx+1, narr_persist)
+
+    return np.concatenate(keys).astype(int), np.concatenate(raw)
+
+
+def _smoothed_relations(R, scene_mapping, index, engine='loop', relations=None, sigmoid=True, min_weight=None):
+    """Interpolates the weight of every relation in each scene, relation after relation
+    Args:
+    R             (InteractionNetwork):   interaction time by scene
+    scene_mapping (list):                 episode id of each scene
+    index         (InteractionTimeIndex): interaction time of every speaker by scene
+    engine        (str):                  'loop' (relation by relation) or 'vectorized' (batches of relations at once)
+    relations     (list):                 (first speaker, second speaker) tuples to process (all relations of R if None)
+    sigmoid       (bool):                 map the weights with the sigmoid function (raw weights otherwise)
+    min_weight    (float):                leave out the scenes in which the relation is weighted less, after sigmoid mapping (none if None);
+                                          with the loop engine only, long spans weighted less are skipped without being processed
+
+    Yields:
+    fSpk          (str):                  first speaker
+    sSpk          (str):                  second speaker
+    scene_indices (np.ndarray):           scenes in which the relation is weighted, in increasing order
+    weights       (np.ndarray):           interpolated weight of the relation in these scenes
+    """
+
+    if relations is None:
+        relations = _relations(R)
+
+    if engine == 'vectorized':
+        yield from _vectorized_relations(R, scene_mapping, index, relations, sigmoid=sigmoid, min_weight=min_weight)
+        return
+
+    if min_weight is not None:
+        min_raw = _min_raw_weight(min_weight)
+
+    for fSpk, sSpk in relations:
+        occ_indices, occ_weights = R.edges(fSpk, sSpk)
+        if min_weight is None:
+            scene_indices, raw = _smooth_relation(fSpk, sSpk,
+                                                  occ_indices.tolist(),
+                                                  occ_weights.tolist(),
+                                                  index,
+                                                  len(scene_mapping))
+        else:
+            scene_indices, raw = _smooth_relation_above(fSpk, sSpk,
+                                                        occ_indices.tolist(),
+                                                        occ_weights.tolist(),
+                                                        index,
+                                                        len(scene_mapping),
+                                                        min_raw)
+
+        yield fSpk, sSpk, scene_indices, _sigmoid(raw) if sigmoid else raw
+
+
+# inputs of the smoothing workers, inherited by forked processes instead of being pickled for every task
+_worker_inputs = None
+
+
+def _init_smoothing_worker(inputs):
+    """Records the inputs of a smoothing worker (for platforms where processes cannot be forked)"""
+
+    global _worker_inputs
+    _worker_inputs = inputs
+
+
+def _smooth_relation_chunk(relations):
+    """Interpolates the weight of a chunk of relations, in a worker process
+    Args:
+    relations     (list):       (first speaker, second speaker) tuples
+
+    Returns:
+    n_edges       (np.ndarray): number of edges of every relation
+    scene_indices (np.ndarray): scenes in which every relation is weighted, concatenated
+    weights       (np.ndarray): interpolated weight of every relation in these scenes, concatenated
+    """
+
+    R, scene_mapping, index, engine, sigmoid, min_weight = _worker_inputs
+
+    smoothed = list(_smoothed_relations(R, scene_mapping, index, engine, relations, sigmoid, min_weight))
+
+    return (np.array([scene_indices.shape[0] for _, _, scene_indices, _ in smoothed]),
+            np.concatenate([scene_indices for _, _, scene_indices, _ in smoothed]),
+            np.concatenate([weights for _, _, _, weights in smoothed]))
+
+
+def _parallel_relations(R, scene_mapping, index, engine, workers, sigmoid=True, min_weight=None):
+    """Interpolates the weight of every relation in each scene, chunks of relations in parallel processes
+
+    Relations are yielded in the same order as by _smoothed_relations, whatever the number of workers.
+
+    Args:
+    R             (InteractionNetwork):   interaction time by scene
+    scene_mapping (list):                 episode id of each scene
+    index         (InteractionTimeIndex): interaction time of every speaker by scene
+    engine        (str):                  'loop' (relation by relation) or 'vectorized' (batches of relations at once)
+    workers       (int):                  number of worker processes
+    sigmoid       (bool):                 map the weights with the sigmoid function (raw weights otherwise)
+    min_weight    (float):                leave out the scenes in which the relation is weighted less, after sigmoid mapping (none if None)
+
+    Yields:
+    fSpk          (str):                  first speaker
+    sSpk          (str):                  second speaker
+    scene_indices (np.ndarray):           scenes in which the relation is weighted, in increasing order
+    weights       (np.ndarray):           interpolated weight of the relation in these scenes
+    """
+
+    global _worker_inputs
+
+    relations = _relations(R)
+
+    # a few chunks per worker, to balance the load
+    chunk_size = max(1, -(-len(relations) // (4 * workers)))
+    chunks = [relations[b:b+chunk_size] for b in range(0, len(relations), chunk_size)]
+
+    inputs = (R, scene_mapping, index, engine, sigmoid, min_weight)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        # forked workers share the inputs with the parent process
+        context = multiprocessing.get_context('fork')
+        _worker_inputs, initializer, initargs = inputs, None, ()
+    else:
+        # otherwise, the inputs are sent once to every worker
+        context = multiprocessing.get_context('spawn')
+        initializer, initargs = _init_smoothing_worker, (inputs,)
+
+    try:
+        with context.Pool(workers, initializer, initargs) as pool:
+            for chunk, (n_edges, scene_indices, weights) in zip(chunks, pool.imap(_smooth_relation_chunk, chunks)):
+                offsets = np.concatenate([[0], np.cumsum(n_edges)])
+                for p, (fSpk, sSpk) in enumerate(chunk):
+                    yield fSpk, sSpk, scene_indices[offsets[p]:offsets[p+1]], weights[offsets[p]:offsets[p+1]]
+    finally:
+        _worker_inputs = None
+
+
+def _anticipation_window(sep_time, occ, occ_weight, run, next_weight, has_next):
+    """Narrative anticipation over a window of scenes, carried over from the following windows
+    Args:
+    sep_time    (np.ndarray): interaction time of every relation with other characters in each scene of the window, shape (n_relations, n_scenes)
+    occ         (np.ndarray): mask of the occurrences of every relation in each scene of the window
+    occ_weight  (np.ndarray): interaction time of every relation in each scene of the window
+    run         (np.ndarray): interaction time with other characters from the end of the window to the next occurrence of every relation
+    next_weight (np.ndarray): interaction time of the next occurrence of every relation
+    has_next    (np.ndarray): mask of the relations occurring after the window
+
+    Returns:
+    anticip     (np.ndarray): narrative anticipation on the next occurrence of every relation in each scene of the window
+    next_mask   (np.ndarray): mask of the scenes followed by an occurrence of every relation
+    state       (tuple):      (run, next_weight, has_next) at the start of the window
+    """
+
+    run, next_weight, has_next = run.copy(), next_weight.copy(), has_next.copy()
+    anticip = np.empty_like(sep_time)
+    next_mask = np.empty_like(occ)
+
+    # summed backward from the next occurrence, in the same order as by _smooth_relation
+    for t in range(sep_time.shape[1] - 1, -1, -1):
+        run += sep_time[:, t]
+        anticip[:, t] = next_weight - run
+        next_mask[:, t] = has_next
+
+        o = occ[:, t]
+        run[o] = 0.0
+        next_weight[o] = occ_weight[o, t]
+        has_next |= o
+
+    return anticip, next_mask, (run, next_weight, has_next)
+
+
+def _persistence_window(sep_time, occ, occ_weight, run, last_weight, has_last, interacting):
+    """Narrative persistence over a window of scenes, carried over from the preceding windows
+    Args:
+    sep_time      (np.ndarray): interaction time of every relation with other characters in each scene of the window, shape (n_relations, n_scenes)
+    occ           (np.ndarray): mask of the occurrences of every relation in each scene of the window
+    occ_weight    (np.ndarray): interaction time of every relation in each scene of the window
+    run           (np.ndarray): interaction time with other characters from the last occurrence of every relation to the start of the window
+    last_weight   (np.ndarray): interaction time of the last occurrence of every relation
+    has_last      (np.ndarray): mask of the relations occurring before the window
+    interacting   (np.ndarray): mask of the relations of which either character interacted with others before the window
+
+    Returns:
+    persist       (np.ndarray): narrative persistence of the last occurrence of every relation in each scene of the window
+    last_mask     (np.ndarray): mask of the scenes preceded by an occurrence of every relation
+    interact_mask (np.ndarray): mask of the scenes up to which either character has interacted with others
+    state         (tuple):      (run, last_weight, has_last, interacting) at the end of the window
+    """
+
+    run, last_weight, has_last, interacting = run.copy(), last_weight.copy(), has_last.copy(), interacting.copy()
+    persist = np.empty_like(sep_time)
+    last_mask = np.empty_like(occ)
+    interact_mask = np.empty_like(occ)
+
+    # summed forward from the last occurrence, in the same order as by _smooth_relation
+    for t in range(sep_time.shape[1]):
+        run += sep_time[:, t]
+        persist[:, t] = last_weight - run
+        last_mask[:, t] = has_last
+        interacting |= sep_time[:, t] > 0
+        interact_mask[:, t] = interacting
+
+        o = occ[:, t]
+        run[o] = 0.0
+        last_weight[o] = occ_weight[o, t]
+        has_last |= o
+
+    return persist, last_mask, interact_mask, (run, last_weight, has_last, interacting)
+
+
+def _chunked_relations(R, scene_mapping, window=1024, sigmoid=True, min_weight=None):
+    """Interpolates the weight of every relation in each scene, window of scenes after window of scenes
+
+    The interaction time of the speakers is only computed over one window of scenes at a time.
+    A first, backward pass over the windows records the pending anticipation of every relation
+    (interaction time with other characters summed down from its next occurrence) at every
+    window boundary, as well as the last scene weighted after its last occurrence. A second,
+    forward pass carries the persistence of every relation across windows, and yields the edges
+    of every window as soon as they are weighted. Sums are carried in the same order as by
+    _smooth_relation, so that the weights are identical.
+
+    Args:
+    R             (InteractionNetwork):   interaction time by scene
+    scene_mapping (list):                 episode id of each scene
+    window        (int):                  number of scenes processed at once
+    sigmoid       (bool):                 map the weights with the sigmoid function (raw weights otherwise)
+    min_weight    (float):                leave out the scenes in which the relation is weighted less, after sigmoid mapping (none if None);
+                                          every scene of the window is still processed
+
+    Yields:
+    fSpk          (str):                  first speaker
+    sSpk          (str):                  second speaker
+    scene_indices (np.ndarray):           scenes of the window in which the relation is weighted, in increasing order
+    weights       (np.ndarray):           interpolated weight of the relation in these scenes
+    """
+
+    n_scenes = len(scene_mapping)
+    relations = _relations(R)
+    n_relations = len(relations)
+
+    speakers = {spk: row for row, spk in enumerate(R.nodes)}
+    f_rows = np.array([speakers[fSpk] for fSpk, _ in relations], dtype=np.int64)
+    s_rows = np.array([speakers[sSpk] for _, sSpk in relations], dtype=np.int64)
+
+    # relation of every pair of speakers (none for self-interactions)
+    relation_idx = {relation: p for p, relation in enumerate(relations)}
+    pair_relation = np.array([relation_idx.get((R.nodes[f], R.nodes[s]), relation_idx.get((R.nodes[s], R.nodes[f]), -1))
+                              for f, s in zip(R.pair_source.tolist(), R.pair_target.tolist())], dtype=np.int64)
+
+    if min_weight is not None:
+        min_raw = _min_raw_weight(min_weight)
+
+    def window_time(start, stop):
+        # interaction time of every relation with other characters, and occurrences, in each scene of the window
+        scene_time = R.speaker_time(stop - start, start)
+        sep_time = scene_time[f_rows] + scene_time[s_rows]
+
+        pairs, scenes, weights = R.scene_edges(start, stop)
+        rows = pair_relation[pairs]
+        rows, scenes, weights = rows[rows >= 0], scenes[rows >= 0] - start, weights[rows >= 0]
+
+        occ = np.zeros(sep_time.shape, dtype=bool)
+        occ_weight = np.zeros(sep_time.shape)
+        occ[rows, scenes] = True
+        occ_weight[rows, scenes] = weights
+
+        return sep_time, occ, occ_weight
+
+    bounds = list(range(0, n_scenes, window)) + [n_scenes]
+
+    # backward pass: pending anticipation at the end of every window, and end of the relations
+    pending = []
+    state = (np.zeros(n_relations), np.zeros(n_relations), np.zeros(n_relations, dtype=bool))
+    last_weighted = np.full(n_relations, -1, dtype=np.int64)
+    for start, stop in zip(reversed(bounds[:-1]), reversed(bounds[1:])):
+        pending.append(state)
+        sep_time, occ, occ_weight = window_time(start, stop)
+        _, next_mask, state = _anticipation_window(sep_time, occ, occ_weight, *state)
+
+        # last scene in which either character interacted with others, after the last occurrence
+        after = ~next_mask & ~occ & (sep_time > 0)
+        last = after.shape[1] - 1 - np.argmax(np.flip(after, axis=1), axis=1)
+        update = (last_weighted < 0) & after.any(axis=1)
+        last_weighted[update] = start + last[update]
+    pending.reverse()
+
+    # forward pass: edges of every window
+    state = (np.zeros(n_relations), np.zeros(n_relations), np.zeros(n_relations, dtype=bool), np.zeros(n_relations, dtype=bool))
+    for w, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        sep_time, occ, occ_weight = window_time(start, stop)
+        anticip, next_mask, _ = _anticipation_window(sep_time, occ, occ_weight, *pending[w])
+        persist, last_mask, interact_mask, state = _persistence_window(sep_time, occ, occ_weight, *state)
+        pending[w] = None
+
+        between = last_mask & next_mask
+        raw = np.where(between, np.maximum(persist, anticip), np.where(last_mask, persist, anticip))
+        raw[occ] = occ_weight[occ]
+
+        # before the first occurrence: from the first scene in which either character interacted with others
+        before = ~last_mask & next_mask & interact_mask
+
+        # after the last occurrence: up to the last scene in which either character interacted with others
+        after = last_mask & ~next_mask & (np.arange(start, stop) <= last_weighted[:, None])
+
+        active = occ | between | before | after
+
+        # every scene of the window is weighted: the scenes weighted less are only masked out
+        if min_weight is not None:
+            active &= raw >= min_raw
+
+        rows, cols = np.nonzero(active)
+        raw = raw[rows, cols]
+
+        weights = _sigmoid(raw) if sigmoid else raw
+        scene_indices = cols + start
+        offsets = np.searchsorted(rows, np.arange(n_relations + 1))
+
+        for p in np.flatnonzero(np.diff(offsets)).tolist():
+            fSpk, sSpk = relations[p]
+            yield fSpk, sSpk, scene_indices[offsets[p]:offsets[p+1]], weights[offsets[p]:offsets[p+1]]
+
+
+def _merge_windows(relations, windowed_relations):
+    """Gathers the edges of every relation over all windows of scenes
+    Args:
+    relations          (list):     (first speaker, second speaker) tuples, in the order they are yielded
+    windowed_relations (iterable): (fSpk, sSpk, scene_indices, weights) of every relation within every window
+
+    Yields:
+    fSpk               (str):        first speaker
+    sSpk               (str):        second speaker
+    scene_indices      (np.ndarray): scenes in which the relation is weighted, in increasing order
+    weights            (np.ndarray): interpolated weight of the relation in these scenes
+    """
+
+    scenes = {relation: [] for relation in relations}
+    weights = {relation: [] for relation in relations}
+    for fSpk, sSpk, scene_indices, relation_weights in windowed_relations:
+        scenes[fSpk, sSpk].append(scene_indices)
+        weights[fSpk, sSpk].append(relation_weights)
+
+    for relation in relations:
+        scene_indices = np.concatenate(scenes.pop(relation) or [np.empty(0, dtype=int)])
+        relation_weights = np.concatenate(weights.pop(relation) or [np.empty(0)])
+        yield relation[0], relation[1], scene_indices, relation_weights
+
+
+def _reported(smoothed_relations, progress):
+    """Reports the progress of narrative smoothing as relations are yielded
+    Args:
+    smoothed_relations (iterable): (fSpk, sSpk, scene_indices, weights) of every relation
+    progress           (Progress): progress reporter
+
+    Yields:
+    smoothed_relation  (tuple):    (fSpk, sSpk, scene_indices, weights) of every relation
+    """
+
+    for smoothed_relation in smoothed_relations:
+        progress.update(1, edges=len(smoothed_relation[2]))
+        yield smoothed_relation
+
+    progress.close()
+
+
+def narrative_smoothing(R, scene_mapping, index=None, engine='loop', compact=False, workers=1, min_weight=None, window=None, progress=None):
     """Interpolates the weight of every relation in each scene
     Args:
-    R             (nx.MultiGraph): undirected, weighted multigraph of interaction time by scene
-    scene_mapping (list):          episode id of each scene
+    R             (InteractionNetwork):   interaction time by scene
+    scene_mapping (list):                 episode id of each scene
+    index         (InteractionTimeIndex): precomputed interaction time of every speaker by scene (built from R if None)
+    engine        (str):                  'loop' (relation by relation) or 'vectorized' (batches of relations at once)
+    compact       (bool):                 return a compact, array-backed network instead of a multigraph
+    workers       (int):                  number of worker processes
+    min_weight    (float):                leave out the edges weighted less (none if None)
+    window        (int):                  smooth windows of this number of scenes at a time, in bounded memory (all scenes at once if None)
+    progress      (Progress):             progress reporter, updated with every relation smoothed (none if None)
 
     Returns:
-    S             (nx.MultiGraph): undirected multigraph of interpolated interaction weight by scene
+    S             (nx.MultiGraph or DynamicNetwork): undirected multigraph of interpolated interaction weight by scene
     """
-    
+
+    if engine not in ('loop', 'vectorized'):
+        raise ValueError('Unknown smoothing engine: {}'.format(engine))
+
+    if window is not None:
+        if workers > 1:
+            raise ValueError('Windows of scenes are smoothed in a single process')
+        relations = _merge_windows(_relations(R), _chunked_relations(R, scene_mapping, window, min_weight=min_weight))
+
+    else:
+        if index is None:
+            index = InteractionTimeIndex(R, len(scene_mapping))
+
+        if workers > 1:
+            relations = _parallel_relations(R, scene_mapping, index, engine, workers, min_weight=min_weight)
+        else:
+            relations = _smoothed_relations(R, scene_mapping, index, engine, min_weight=min_weight)
+
+    if progress is not None:
+        progress.total = len(_relations(R))
+        relations = _reported(relations, progress)
+
+    if compact:
+        return DynamicNetwork.from_relations(relations, scene_mapping)
+
+    import networkx as nx
+
+    # every speaker of an interacting pair, even if all its edges are weighted less than min_weight
     S = nx.MultiGraph()
+    S.add_nodes_from(spk for relation in _relations(R) for spk in relation)
 
-    nodes = sorted(R.nodes)
-    for i in range(len(nodes)):
-        fSpk = nodes[i]
-        for j in range(i+1, len(nodes)):
-            sSpk = nodes[j]
-
-            if R.has_edge(fSpk, sSpk):
-
-                print('Processing: {} <-> {}'.format(fSpk, sSpk))
-                
-                edges = R[fSpk][sSpk]
-                scene_indices = list(edges.keys())
-                
-                ###################################################
-                # compute relation weight before first occurrence #
-                ###################################################
-                
-                before_time = []
-                for scene_idx in range(scene_indices[0]):
-                    
-                    # interaction time with other characters in current scene
-                    fSpk_sep_time = np.sum([e[3] for e in R.edges(fSpk, data='weight', keys=True) if e[2] == scene_idx])
-                    sSpk_sep_time = np.sum([e[3] for e in R.edges(sSpk, data='weight', keys=True) if e[2] == scene_idx])
-                    before_time.append(fSpk_sep_time + sSpk_sep_time)
-
-                before_time = np.array(before_time)
-
-                # either character has interacted with others before the first occurrence of the relationship
-                if np.any(before_time):
-                    # first scene in which (at least) one of the two characters interacted with others
-                    first_occ_idx = np.argmax(before_time > 0)
-                    
-                    # narrative anticipation on the next occurrence of the relation
-                    cum_from_next = np.flip(np.cumsum(np.flip(before_time)))
-                    narr_anticip = edges[scene_indices[0]]['weight'] - cum_from_next
-
-                    # add edges
-                    for scene_idx in range(first_occ_idx, scene_indices[0]):
-                        S.add_edge(fSpk,
-                                   sSpk,
-                                   key=scene_idx,
-                                   weight=_sigmoid(narr_anticip[scene_idx]),
-                                   episode=scene_mapping[scene_idx])
-
-                ###############################################################
-                # compute relation weight between two consecutive occurrences #
-                ###############################################################
-                        
-                for k in range(len(scene_indices)):
-
-                    # index of last occurrence
-                    last_idx = scene_indices[k]
-
-                    # update graph
-                    # last occurrence
-                    S.add_edge(fSpk,
-                               sSpk,
-                               key=last_idx,
-                               weight=_sigmoid(edges[last_idx]['weight']),
-                               episode=scene_mapping[last_idx])
-
-                    if k < len(scene_indices) - 1:
-                        # index of next occurrence if any
-                        next_idx = scene_indices[k+1]
-                    
-                        # interaction time with other characters in-between
-                        sep_time = []
-                    
-                        for scene_idx in range(last_idx+1, next_idx):
-
-                            # interaction time with other characters in current scene
-                            fSpk_sep_time = np.sum([e[3] for e in R.edges(fSpk, data='weight', keys=True) if e[2] == scene_idx])
-                            sSpk_sep_time = np.sum([e[3] for e in R.edges(sSpk, data='weight', keys=True) if e[2] == scene_idx])
-                            sep_time.append(fSpk_sep_time + sSpk_sep_time)
-
-                        cum_from_last = np.cumsum(sep_time)
-                        cum_from_next = np.flip(np.cumsum(np.flip(sep_time)))
-
-                        # narrative persistence of the last occurrence of the relation
-                        narr_persist = edges[last_idx]['weight'] - cum_from_last
-
-                        # narrative anticipation on the next occurrence of the relation
-                        narr_anticip = edges[next_idx]['weight'] - cum_from_next
-
-                        # weights of the relationship between the last and next occurrences
-                        weights = np.max(np.array([narr_persist, narr_anticip]), axis=0)
-
-                        # update graph
-                        # between last and next occurrences
-                        for i in np.arange(weights.shape[0]):
-                            S.add_edge(fSpk,
-                                       sSpk,
-                                       key=last_idx+i+1,
-                                       weight=_sigmoid(weights[i]),
-                                       episode=scene_mapping[last_idx+i+1])
-
-                        # next occurrence
-                        S.add_edge(fSpk,
-                                   sSpk,
-                                   key=next_idx,
-                                   weight=_sigmoid(edges[next_idx]['weight']),
-                                   episode=scene_mapping[next_idx])
-
-                #################################################
-                # compute relation weight after last occurrence #
-                #################################################
-
-                after_time = []
-                for scene_idx in range(scene_indices[-1] + 1, len(scene_mapping)):
-
-                    # interaction time with other characters in current scene
-                    fSpk_sep_time = np.sum([e[3] for e in R.edges(fSpk, data='weight', keys=True) if e[2] == scene_idx])
-                    sSpk_sep_time = np.sum([e[3] for e in R.edges(sSpk, data='weight', keys=True) if e[2] == scene_idx])
-                    after_time.append(fSpk_sep_time + sSpk_sep_time)
-
-                after_time = np.array(after_time)
-
-                # either character has interacted with others after the last occurrence of the relationship
-                if np.any(after_time):
-                    
-                    # last scene in which (at least) one of the two characters interacted with others
-                    last_occ_idx = after_time.shape[0] - np.argmax(np.flip(after_time) > 0) - 1
-
-                    # narrative persistence of the last occurrence of the relation
-                    cum_from_last = np.cumsum(after_time)
-                    narr_persist = edges[scene_indices[-1]]['weight'] - cum_from_last
-
-                    # add edges
-                    for k in range(last_occ_idx + 1):
-                        scene_idx = k + scene_indices[-1] + 1
-                        S.add_edge(fSpk,
-                                   sSpk,
-                                   key=scene_idx,
-                                   weight=_sigmoid(narr_persist[k]),
-                                   episode=scene_mapping[scene_idx])
+    for fSpk, sSpk, scene_indices, weights in relations:
+        S.add_edges_from((fSpk, sSpk, scene_idx, {'weight': weight, 'episode': scene_mapping[scene_idx]})
+                         for scene_idx, weight in zip(scene_indices.tolist(), weights))
 
     return S
 
 
+def narrative_smoothing_to_graphml(R, scene_mapping, path, index=None, engine='loop', compress=False, workers=1, min_weight=None, window=None, progress=None):
+    """Interpolates the weight of every relation in each scene, writing out edges to graphml format as they are generated
+    Args:
+    R             (InteractionNetwork):   interaction time by scene
+    scene_mapping (list):                 episode id of each scene
+    path          (str):                  output file name (gzip-compressed if ending with .gz)
+    index         (InteractionTimeIndex): precomputed interaction time of every speaker by scene (built from R if None)
+    engine        (str):                  'loop' (relation by relation) or 'vectorized' (batches of relations at once)
+    compress      (bool):                 gzip-compress the output regardless of the file name
+    workers       (int):                  number of worker processes
+    min_weight    (float):                leave out the edges weighted less (none if None)
+    window        (int):                  smooth windows of this number of scenes at a time, in bounded memory, writing out
+                                          the edges window by window (all scenes at once, relation by relation, if None)
+    progress      (Progress):             progress reporter, updated with every relation (or part of relation within a window) written out (none if None)
+
+    Returns:
+    n_edges       (int):                  number of edges written out
+    """
+
+    if engine not in ('loop', 'vectorized'):
+        raise ValueError('Unknown smoothing engine: {}'.format(engine))
+
+    # speakers, in the order they first appear in relations
+    all_relations = _relations(R)
+    nodes = list(dict.fromkeys(spk for relation in all_relations for spk in relation))
+
+    if window is not None:
+        if workers > 1:
+            raise ValueError('Windows of scenes are smoothed in a single process')
+        relations = _chunked_relations(R, scene_mapping, window, min_weight=min_weight)
+
+    else:
+        if index is None:
+            index = InteractionTimeIndex(R, len(scene_mapping))
+
+        if workers > 1:
+            relations = _parallel_relations(R, scene_mapping, index, engine, workers, min_weight=min_weight)
+        else:
+            relations = _smoothed_relations(R, scene_mapping, index, engine, min_weight=min_weight)
+
+    if progress is not None:
+        if window is not None:
+            progress.unit = 'relation windows'
+        else:
+            progress.total = len(all_relations)
+        relations = _reported(relations, progress)
+
+    return stream_to_graphml(relations, nodes, scene_mapping, path, compress=compress)
+
+
 def export_to_graphml_format(G, path):
     """Writes out multigraph G to graphml format
     Args:
-    H    (nx.MultiGraph): undirected multigraph of interpolated interaction weight by scene
+    H    (nx.MultiGraph or DynamicNetwork): undirected multigraph of interpolated interaction weight by scene
     path (str)          : output file name
 
     Returns:
     None
     """
 
-    nx.write_graphml(G, path)
+    if isinstance(G, DynamicNetwork):
+        stream_to_graphml(G.smoothed_relations(), G.nodes, G.scene_mapping, path)
+    else:
+        import networkx as nx
+        nx.write_graphml(G, path)
     
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import os
+
+import numpy as np
+
+import annotations
+import estimate_interactions
+import network_processing
+import graph_io
+
+from dynamic_network import DynamicNetwork, encode_scene_mapping
+from speech_turns import SpeechTurns
+
+
+def _raw_network(speech_turns, rules, scene_mapping, inter_threshold, engine='loop', workers=1):
+    """Estimates the interlocutors for one silence threshold and interpolates the raw weight of every relation
+    Args:
+    speech_turns    (SpeechTurns): columnar speech turns of the whole series, as distributed over every scene
+    rules           (dict):        speaker turn rules returned by estimate_interactions.speaker_turn_rules
+    scene_mapping   (list):        episode id of each scene
+    inter_threshold (float):       maximum silence duration between verbal interactions
+    engine          (str):         smoothing engine, 'loop' or 'vectorized'
+    workers         (int):         number of worker processes for narrative smoothing
+
+    Returns:
+    relations       (list):        (first speaker, second speaker) of every relation
+    indptr          (np.ndarray):  offsets of every relation into scenes and raw
+    scenes          (np.ndarray):  scenes in which every relation is weighted
+    raw             (np.ndarray):  interaction time, narrative persistence or anticipation, before sigmoid mapping
+    """
+
+    speech_turns = estimate_interactions.sequential_vectorized(speech_turns, inter_threshold, rules)
+
+    R = network_processing.build_interaction_network(speech_turns)
+    index = network_processing.InteractionTimeIndex(R, len(scene_mapping))
+
+    if workers > 1:
+        smoothed = network_processing._parallel_relations(R, scene_mapping, index, engine, workers, sigmoid=False)
+    else:
+        smoothed = network_processing._smoothed_relations(R, scene_mapping, index, engine, sigmoid=False)
+
+    relations, scenes, raw = [], [], []
+    for fSpk, sSpk, scene_indices, weights in smoothed:
+        relations.append((fSpk, sSpk))
+        scenes.append(scene_indices)
+        raw.append(weights)
+
+    indptr = np.concatenate([[0], np.cumsum([s.shape[0] for s in scenes], dtype=np.int64)])
+
+    return (relations,
+            indptr,
+            np.concatenate(scenes) if scenes else np.empty(0, dtype=np.int64),
+            np.concatenate(raw) if raw else np.empty(0))
+
+
+def _stack(networks, n_scenes):
+    """Aligns the weights of several settings on the union of their edges
+    Args:
+    networks  (list):       (relations, indptr, scenes, weights) of every inter_threshold, weights of shape (n_mu, n_edges)
+    n_scenes  (int):        number of scenes
+
+    Returns:
+    relations (list):       (first speaker, second speaker) of every relation, over all settings
+    indptr    (np.ndarray): offsets of every relation into scenes
+    scenes    (np.ndarray): scenes in which every relation is weighted in at least one setting
+    weights   (np.ndarray): weight of every edge in each setting (NaN if not weighted), shape (n_thresholds, n_mu, n_edges)
+    """
+
+    relations = sorted(set(relation for network in networks for relation in network[0]))
+    relation_idx = {relation: i for i, relation in enumerate(relations)}
+
+    # edges keyed by relation and scene
+    keys = []
+    for network_relations, indptr, scenes, _ in networks:
+        ids = np.array([relation_idx[relation] for relation in network_relations], dtype=np.int64)
+        keys.append(np.repeat(ids, np.diff(indptr)) * n_scenes + scenes)
+
+    all_keys = np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+
+    n_mu = networks[0][3].shape[0] if networks else 0
+    weights = np.full((len(networks), n_mu, all_keys.shape[0]), np.nan, dtype=np.float32)
+    for t, (key, network) in enumerate(zip(keys, networks)):
+        weights[t][:, np.searchsorted(all_keys, key)] = network[3]
+
+    edge_relation = all_keys // max(n_scenes, 1)
+    indptr = np.searchsorted(edge_relation, np.arange(len(relations) + 1))
+
+    return relations, indptr, all_keys - edge_relation * n_scenes, weights
+
+
+def parameter_sweep(input_annot_fname, inter_thresholds, mus, output_dir=None, output_format='npz', output_stacked_fname=None, engine='loop', workers=1):
+    """Generates the dynamic network of interacting speakers over a grid of inter_threshold and sigmoid steepness values
+
+    The annotations are read and the speech turns assigned to scenes once, and speaker turns
+    segmented once, whatever the number of settings. The relations are smoothed once per
+    inter_threshold value, and the raw weights mapped with every sigmoid steepness at once.
+
+    Args:
+    input_annot_fname    (str):   input annotation file (possibly gzip-compressed)
+    inter_thresholds     (list):  maximum silence durations between verbal interactions
+    mus                  (list):  steepness values of the sigmoid mapping
+    output_dir           (str):   directory of the output file of every setting (none if None)
+    output_format        (str):   format of these output files: 'graphml', 'graphml.gz', 'npz', 'parquet' or 'npy'
+    output_stacked_fname (str):   output .npz file with the weights of all settings stacked (none if None)
+    engine               (str):   smoothing engine, 'loop' or 'vectorized'
+    workers              (int):   number of worker processes for narrative smoothing
+
+    Returns:
+    networks             (dict):  dynamic network (DynamicNetwork) of every (inter_threshold, mu) setting
+    """
+
+    input_annot_fname = os.path.expanduser(input_annot_fname)
+
+    # speech turns of the whole series, as distributed over every scene
+    episode_speech_turns = []
+    for i, j, episode in annotations.iter_episodes(input_annot_fname):
+        episode_speech_turns.append(('S{:02d}E{:02d}'.format(i+1, j+1), SpeechTurns.from_episode(episode)))
+
+    speech_turns = SpeechTurns.concatenate([part for _, part in episode_speech_turns])
+    scene_mapping = [episode_id for episode_id, part in episode_speech_turns for k in range(part.n_scenes)]
+    episodes, scene_episode = encode_scene_mapping(scene_mapping)
+
+    # speaker turns do not depend on the silence threshold
+    rules = estimate_interactions.speaker_turn_rules(speech_turns)
+
+    mus = np.asarray(mus, dtype=np.float64)
+
+    if output_dir is not None:
+        output_dir = os.path.expanduser(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+    networks = {}
+    stacked = []
+    for inter_threshold in inter_thresholds:
+        relations, indptr, scenes, raw = _raw_network(speech_turns, rules, scene_mapping, inter_threshold, engine, workers)
+
+        # sigmoid mapping with every steepness value at once
+        weights = network_processing._sigmoid(raw[None, :], mus[:, None])
+
+        for mu, mu_weights in zip(mus.tolist(), weights):
+            S = DynamicNetwork(relations, indptr, scenes, mu_weights, episodes, scene_episode)
+            networks[inter_threshold, mu] = S
+
+            if output_dir is not None:
+                path = os.path.join(output_dir, 'inter_threshold={}_mu={}.{}'.format(inter_threshold, mu, output_format))
+                if output_format.startswith('graphml'):
+                    network_processing.export_to_graphml_format(S, path)
+                else:
+                    graph_io.export_to_binary_format(S, path)
+
+        if output_stacked_fname is not None:
+            stacked.append((relations, indptr, scenes, weights))
+
+    if output_stacked_fname is not None:
+        relations, indptr, scenes, weights = _stack(stacked, len(scene_mapping))
+        nodes = list(dict.fromkeys(spk for relation in relations for spk in relation))
+        node_idx = {spk: i for i, spk in enumerate(nodes)}
+
+        np.savez(os.path.expanduser(output_stacked_fname),
+                 inter_threshold=np.asarray(inter_thresholds, dtype=np.float64),
+                 mu=mus,
+                 nodes=np.array(nodes, dtype=str),
+                 relation_source=np.array([node_idx[fSpk] for fSpk, _ in relations], dtype=np.int64),
+                 relation_target=np.array([node_idx[sSpk] for _, sSpk in relations], dtype=np.int64),
+                 indptr=indptr,
+                 scene=scenes.astype(np.int32),
+                 weight=weights,
+                 episodes=np.array(episodes, dtype=str),
+                 scene_episode=scene_episode)
+
+    return networks
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_annot_fname',
+                        type=str,
+                        help='Annotation file name (.json, possibly gzip-compressed).',
+                        required=True)
+
+    parser.add_argument('--inter_thresholds',
+                        type=float,
+                        nargs='+',
+                        help='Maximum silence durations (in seconds) between verbal interactions (default: 5.0).',
+                        default=[5.0])
+
+    parser.add_argument('--mus',
+                        type=float,
+                        nargs='+',
+                        help='Steepness values of the sigmoid mapping of relation weights (default: 0.01).',
+                        default=[0.01])
+
+    parser.add_argument('--output_dir',
+                        type=str,
+                        help='Output directory, with one file per setting, named "inter_threshold=<value>_mu=<value>.<format>".')
+
+    parser.add_argument('--output_format',
+                        type=str,
+                        choices=['graphml', 'graphml.gz', 'npz', 'parquet', 'npy'],
+                        help='Format of the output file of every setting (default: npz).',
+                        default='npz')
+
+    parser.add_argument('--output_stacked_fname',
+                        type=str,
+                        help='Output .npz file with the weights of all settings stacked, of shape (n_thresholds, n_mus, n_edges).')
+
+    parser.add_argument('--engine',
+                        type=str,
+                        choices=['loop', 'vectorized'],
+                        help='Narrative smoothing engine: relation by relation (default) or vectorized over all relations.',
+                        default='loop')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of worker processes for narrative smoothing (default: 1).',
+                        default=1)
+
+    args = parser.parse_args(argv)
+
+    if args.output_dir is None and args.output_stacked_fname is None:
+        parser.error('at least one of --output_dir and --output_stacked_fname is required')
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    parameter_sweep(args.input_annot_fname,
+                    args.inter_thresholds,
+                    args.mus,
+                    output_dir=args.output_dir,
+                    output_format=args.output_format,
+                    output_stacked_fname=args.output_stacked_fname,
+                    engine=args.engine,
+                    workers=args.workers)
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+
+class Profiler:
+    """Wall time and peak memory of the stages of the generation of a dynamic network, with counters
+
+    Stages may be entered several times (e.g. once per episode): their wall time is summed and
+    their peak memory is the maximum over all calls. Memory is traced with tracemalloc (Python
+    and NumPy allocations of the current process only), which slows down execution: it is only
+    traced if trace_memory is set.
+
+    Args:
+    trace_memory (bool): record the peak memory of every stage
+
+    Attributes:
+    stages       (dict): wall time (s), number of calls and peak memory (bytes) of every stage, in order of first call
+    counters     (dict): value of every counter, in order of first update
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.counters = {}
+        self._start = time.perf_counter()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _record(self, name, wall_time, peak_memory=None):
+        stage = self.stages.setdefault(name, {'wall_time': 0.0, 'calls': 0, 'peak_memory': None})
+        stage['wall_time'] += wall_time
+        stage['calls'] += 1
+        if peak_memory is not None:
+            stage['peak_memory'] = max(stage['peak_memory'] or 0, peak_memory)
+
+    @contextmanager
+    def stage(self, name):
+        """Records the wall time and peak memory of a stage
+        Args:
+        name (str): stage name
+        """
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+            self._record(name, wall_time, tracemalloc.get_traced_memory()[1] if self.trace_memory else None)
+
+    def iterate(self, name, iterable):
+        """Records the time spent producing every item of an iterable as a stage
+        Args:
+        name     (str):      stage name
+        iterable (iterable): items, e.g. read from a file
+
+        Yields:
+        item     (object):   every item of the iterable
+        """
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, n=1):
+        """Adds n to a counter
+        Args:
+        name (str): counter name
+        n    (int): increment
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """Machine-readable report
+
+        Returns:
+        report (dict): total wall time, stages and counters
+        """
+
+        return {'wall_time': time.perf_counter() - self._start,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    def save(self, path):
+        """Writes out the report in JSON format
+        Args:
+        path (str): output file name
+        """
+
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        """Human-readable report
+
+        Returns:
+        summary (str): one line per stage and per counter
+        """
+
+        report = self.report()
+        lines = ['{:<24} {:>10} {:>8} {:>14}'.format('stage', 'time (s)', 'calls', 'peak mem (MB)')]
+        for name, stage in report['stages'].items():
+            peak = '{:.1f}'.format(stage['peak_memory'] / 2**20) if stage['peak_memory'] is not None else '-'
+            lines.append('{:<24} {:>10.3f} {:>8} {:>14}'.format(name, stage['wall_time'], stage['calls'], peak))
+        lines.append('{:<24} {:>10.3f}'.format('total', report['wall_time']))
+        for name, value in report['counters'].items():
+            lines.append('{:<24} {:>10}'.format(name, value))
+
+        return '\n'.join(lines)
+
+
+class Progress:
+    """Throttled progress reporter, writing out at most one line every interval seconds
+
+    Args:
+    desc     (str):   description of the task
+    total    (int):   expected number of items (unknown if None)
+    unit     (str):   name of the items
+    interval (float): minimum time between two reports, in seconds (silent if None)
+    file     (file):  output stream (standard error if None)
+
+    Attributes:
+    n        (int):   number of items processed
+    edges    (int):   number of edges emitted
+    """
+
+    def __init__(self, desc, total=None, unit='relations', interval=1.0, file=None):
+        self.desc = desc
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.file = file
+        self.n = 0
+        self.edges = 0
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def _write(self):
+        elapsed = time.perf_counter() - self._start
+        done = '{}/{}'.format(self.n, self.total) if self.total is not None else str(self.n)
+        (self.file or sys.stderr).write('{}: {} {}, {} edges ({:.1f}s)\n'.format(self.desc, done, self.unit, self.edges, elapsed))
+
+    def update(self, n=1, edges=0):
+        """Records processed items, and reports progress if the last report is old enough
+        Args:
+        n     (int): number of items processed
+        edges (int): number of edges emitted
+        """
+
+        self.n += n
+        self.edges += edges
+
+        if self.interval is not None:
+            now = time.perf_counter()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._write()
+
+    def close(self):
+        """Reports the final progress"""
+
+        if self.interval is not None:
+            self._write()
+
+
+def stage(profiler, name):
+    """Stage of an optional profiler
+    Args:
+    profiler (Profiler):       profiler (none if None)
+    name     (str):            stage name
+
+    Returns:
+    context  (contextmanager): records the stage, or does nothing if there is no profiler
+    """
+
+    return profiler.stage(name) if profiler is not None else nullcontext()
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from utils import assign_speech_turns_to_scene_offsets
+
+
+class SpeechTurns:
+    """Columnar speech turns, as distributed over scenes
+
+    Speaker names are interned: speakers and interlocutors are stored as ids into names. The
+    speech turns of the i-th scene are scene_offsets[i]:scene_offsets[i+1], and the interlocutors
+    of the t-th speech turn are interloc_ids[interloc_indptr[t]:interloc_indptr[t+1]].
+
+    Args:
+    names           (list):       speaker names, indexed by speaker id
+    speaker         (np.ndarray): speaker id of every speech turn
+    start           (np.ndarray): starting point of every speech turn
+    end             (np.ndarray): ending point of every speech turn
+    scene_offsets   (np.ndarray): offsets of every scene into the speech turns, shape (n_scenes+1,)
+    interloc_indptr (np.ndarray): offsets of every speech turn into interloc_ids, shape (n_turns+1,)
+    interloc_ids    (np.ndarray): speaker ids of the interlocutors
+    annotated       (np.ndarray): whether the interlocutors of every speech turn are manually annotated
+    """
+
+    _columns = ('speaker', 'start', 'end', 'scene_offsets', 'interloc_indptr', 'interloc_ids', 'annotated')
+
+    def __init__(self, names, speaker, start, end, scene_offsets, interloc_indptr, interloc_ids, annotated):
+        self.names = list(names)
+        self.speaker = np.asarray(speaker, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.scene_offsets = np.asarray(scene_offsets, dtype=np.int64)
+        self.interloc_indptr = np.asarray(interloc_indptr, dtype=np.int64)
+        self.interloc_ids = np.asarray(interloc_ids, dtype=np.int32)
+        self.annotated = np.asarray(annotated, dtype=bool)
+
+    def __len__(self):
+        return self.speaker.shape[0]
+
+    @property
+    def n_scenes(self):
+        """Number of scenes"""
+
+        return self.scene_offsets.shape[0] - 1
+
+    @classmethod
+    def from_episode(cls, episode):
+        """Distributes the speech turns of an episode over its scenes (see utils.assign_speech_turns_to_scene_offsets)
+        Args:
+        episode      (dict):        episode annotations
+
+        Returns:
+        speech_turns (SpeechTurns): speech turns of the episode, with manual interlocutors if any
+        """
+
+        speech_segments = episode['data']['speech_segments']
+
+        offsets = assign_speech_turns_to_scene_offsets([scene['start'] for scene in episode['data']['scenes']],
+                                                       episode['duration'],
+                                                       [speech_turn['start'] for speech_turn in speech_segments],
+                                                       [speech_turn['end'] for speech_turn in speech_segments])
+
+        # speech turns past the last scene are left out
+        return cls._from_dicts(speech_segments[:offsets[-1]], offsets)
+
+    @classmethod
+    def from_scene_speech_turns(cls, scene_speech_turns):
+        """Converts speech turns, as distributed over every scene, to columnar speech turns
+        Args:
+        scene_speech_turns (list or dict): speech turns of every scene
+
+        Returns:
+        speech_turns       (SpeechTurns):  columnar speech turns
+        """
+
+        if isinstance(scene_speech_turns, dict):
+            scene_speech_turns = [scene_speech_turns[i] for i in range(len(scene_speech_turns))]
+
+        offsets = np.cumsum([0] + [len(speech_turns) for speech_turns in scene_speech_turns])
+
+        return cls._from_dicts([speech_turn for speech_turns in scene_speech_turns for speech_turn in speech_turns], offsets)
+
+    @classmethod
+    def _from_dicts(cls, speech_turns, scene_offsets):
+        name_idx = {}
+
+        def intern(name):
+            return name_idx.setdefault(name, len(name_idx))
+
+        speaker = [intern(speech_turn['speaker']) for speech_turn in speech_turns]
+        annotated = ['interlocutors' in speech_turn for speech_turn in speech_turns]
+        interlocs = [speech_turn.get('interlocutors', ()) for speech_turn in speech_turns]
+        interloc_ids = [intern(name) for interloc in interlocs for name in interloc]
+
+        return cls(list(name_idx),
+                   speaker,
+                   [speech_turn['start'] for speech_turn in speech_turns],
+                   [speech_turn['end'] for speech_turn in speech_turns],
+                   scene_offsets,
+                   np.cumsum([0] + [len(interloc) for interloc in interlocs]),
+                   interloc_ids,
+                   annotated)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Concatenates the speech turns of consecutive episodes
+        Args:
+        parts        (list):        columnar speech turns of every episode, in order
+
+        Returns:
+        speech_turns (SpeechTurns): columnar speech turns of all episodes, over all their scenes
+        """
+
+        name_idx = {}
+        speaker, interloc_ids = [], []
+        start, end, annotated = [], [], []
+        scene_offsets, interloc_indptr = [np.zeros(1, dtype=np.int64)], [np.zeros(1, dtype=np.int64)]
+        n_turns, n_interlocs = 0, 0
+
+        for part in parts:
+            # speaker ids of the part, in the merged table of names
+            mapping = np.array([name_idx.setdefault(name, len(name_idx)) for name in part.names], dtype=np.int32)
+
+            speaker.append(mapping[part.speaker])
+            interloc_ids.append(mapping[part.interloc_ids])
+            start.append(part.start)
+            end.append(part.end)
+            annotated.append(part.annotated)
+            # parts may have no speech turns, or no scenes
+            scene_offsets.append(part.scene_offsets[1:] + n_turns)
+            interloc_indptr.append(part.interloc_indptr[1:] + n_interlocs)
+            n_turns += len(part)
+            n_interlocs += int(part.interloc_indptr[-1])
+
+        def concat(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+        return cls(list(name_idx),
+                   concat(speaker, np.int32),
+                   concat(start, np.float64),
+                   concat(end, np.float64),
+                   np.concatenate(scene_offsets),
+                   np.concatenate(interloc_indptr),
+                   concat(interloc_ids, np.int32),
+                   concat(annotated, bool))
+
+    def with_interlocutors(self, interloc_indptr, interloc_ids):
+        """Copy of the speech turns, with other interlocutors
+        Args:
+        interloc_indptr (np.ndarray):  offsets of every speech turn into interloc_ids
+        interloc_ids    (np.ndarray):  speaker ids of the interlocutors
+
+        Returns:
+        speech_turns    (SpeechTurns): columnar speech turns
+        """
+
+        return SpeechTurns(self.names, self.speaker, self.start, self.end, self.scene_offsets,
+                           interloc_indptr, interloc_ids, self.annotated)
+
+    def to_scene_speech_turns(self):
+        """Converts the speech turns to lists of dicts, as distributed over every scene
+
+        Returns:
+        scene_speech_turns (list): speech turns, with their interlocutors, of every scene
+        """
+
+        speaker, start, end = self.speaker.tolist(), self.start.tolist(), self.end.tolist()
+        interloc_indptr, interloc_ids = self.interloc_indptr.tolist(), self.interloc_ids.tolist()
+        offsets = self.scene_offsets.tolist()
+
+        speech_turns = [{'speaker': self.names[speaker[t]],
+                         'start': start[t],
+                         'end': end[t],
+                         'interlocutors': [self.names[k] for k in interloc_ids[interloc_indptr[t]:interloc_indptr[t+1]]]}
+                        for t in range(len(self))]
+
+        return [speech_turns[offsets[i]:offsets[i+1]] for i in range(self.n_scenes)]
+
+    def to_arrays(self):
+        """Columns of the speech turns, for storage
+
+        Returns:
+        arrays (dict): names and columns, as NumPy arrays
+        """
+
+        arrays = {column: getattr(self, column) for column in self._columns}
+        arrays['names'] = np.array(self.names, dtype=str)
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Speech turns from stored columns
+        Args:
+        arrays       (dict):        names and columns, as returned by to_arrays
+
+        Returns:
+        speech_turns (SpeechTurns): columnar speech turns
+        """
+
+        return cls(arrays['names'].tolist(), *(arrays[column] for column in cls._columns))
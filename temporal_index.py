@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class TemporalIndex:
+    """Indexed temporal queries over a dynamic network of interpolated interaction weight by scene
+
+    Relations keep their edges sorted by scene (the CSR layout of DynamicNetwork), so that the
+    weight of a relation at some scene is found by binary search. Edges are also indexed by
+    scene, through a scene-major permutation with per-scene offsets, and episodes are mapped to
+    their (contiguous) ranges of scenes.
+
+    Args:
+    S (DynamicNetwork): compact dynamic network, as returned by network_processing.narrative_smoothing
+                        or graph_io.load_binary_format
+
+    Attributes:
+    nodes        (list):       speakers, indexed by node id
+    source       (np.ndarray): node id of the first speaker of every relation
+    target       (np.ndarray): node id of the second speaker of every relation
+    scene_indptr (np.ndarray): offsets of every scene into scene_edges, shape (n_scenes+1,)
+    scene_edges  (np.ndarray): edges, sorted by scene
+    episodes     (dict):       (first scene, last scene + 1) of every episode
+    """
+
+    def __init__(self, S):
+        self.S = S
+        self.nodes = S.nodes
+        node_idx = {spk: i for i, spk in enumerate(self.nodes)}
+
+        self.source = np.array([node_idx[fSpk] for fSpk, _ in S.relations], dtype=np.int64)
+        self.target = np.array([node_idx[sSpk] for _, sSpk in S.relations], dtype=np.int64)
+        self._relation_idx = {}
+        for i, (f, s) in enumerate(zip(self.source.tolist(), self.target.tolist())):
+            self._relation_idx[f, s] = i
+            self._relation_idx[s, f] = i
+        self._node_idx = node_idx
+
+        # relations of every speaker
+        incident = np.concatenate([self.source, self.target])
+        relation_ids = np.concatenate([np.arange(len(S.relations))] * 2)
+        order = np.argsort(incident, kind='stable')
+        self._node_relations = relation_ids[order]
+        self._node_indptr = np.searchsorted(incident[order], np.arange(len(self.nodes) + 1))
+
+        # relation of every edge, and cumulative weights for range queries
+        self._edge_relation = np.repeat(np.arange(len(S.relations)), np.diff(S.indptr))
+        self._cum_weight = np.zeros(S.number_of_edges() + 1)
+        np.cumsum(self._weights(slice(None)), out=self._cum_weight[1:])
+
+        # edges by scene
+        n_scenes = S.scene_episode.shape[0]
+        self.scene_edges = np.argsort(S.scenes, kind='stable')
+        self.scene_indptr = np.searchsorted(S.scenes[self.scene_edges], np.arange(n_scenes + 1))
+
+        # scene range of every episode
+        bounds = np.flatnonzero(np.diff(S.scene_episode)) + 1
+        starts = np.concatenate([[0], bounds]).tolist()
+        stops = np.concatenate([bounds, [n_scenes]]).tolist()
+        self.episodes = {S.episodes[S.scene_episode[start]]: (start, stop) for start, stop in zip(starts, stops) if start < n_scenes}
+
+    def _weights(self, edges):
+        # weights are stored in single precision
+        return np.round(self.S.weights[edges].astype(np.float64), 4)
+
+    def _relation(self, fSpk, sSpk):
+        return self._relation_idx.get((self._node_idx.get(fSpk), self._node_idx.get(sSpk)))
+
+    def _scene_range(self, i, start, stop):
+        """Edges of the i-th relation within a range of scenes [start, stop)"""
+
+        lo, hi = self.S.indptr[i], self.S.indptr[i+1]
+        scenes = self.S.scenes[lo:hi]
+
+        return lo + np.searchsorted(scenes, start), lo + np.searchsorted(scenes, stop)
+
+    def weight(self, fSpk, sSpk, scene_idx):
+        """Weight of a relation in some scene
+        Args:
+        fSpk      (str):   first speaker
+        sSpk      (str):   second speaker
+        scene_idx (int):   scene index
+
+        Returns:
+        weight    (float): interpolated weight of the relation (None if not weighted in the scene)
+        """
+
+        i = self._relation(fSpk, sSpk)
+        if i is None:
+            return None
+
+        lo, hi = self._scene_range(i, scene_idx, scene_idx + 1)
+        if lo == hi:
+            return None
+
+        return float(self._weights(lo))
+
+    def relation(self, fSpk, sSpk, start=0, stop=None):
+        """Weights of a relation over a range of scenes
+        Args:
+        fSpk    (str):        first speaker
+        sSpk    (str):        second speaker
+        start   (int):        first scene index (inclusive)
+        stop    (int):        last scene index (exclusive; up to the last scene if None)
+
+        Returns:
+        scenes  (np.ndarray): scenes in which the relation is weighted
+        weights (np.ndarray): weight of the relation in these scenes
+        """
+
+        if stop is None:
+            stop = self.S.scene_episode.shape[0]
+
+        i = self._relation(fSpk, sSpk)
+        if i is None:
+            return self.S.scenes[:0], np.empty(0)
+
+        lo, hi = self._scene_range(i, start, stop)
+
+        return self.S.scenes[lo:hi], self._weights(slice(lo, hi))
+
+    def snapshot(self, scene_idx):
+        """Network at some scene
+        Args:
+        scene_idx (int):        scene index
+
+        Returns:
+        source    (np.ndarray): node id of the first speaker of every relation weighted in the scene
+        target    (np.ndarray): node id of the second speaker of these relations
+        weights   (np.ndarray): weight of these relations in the scene
+        """
+
+        edges = self.scene_edges[self.scene_indptr[scene_idx]:self.scene_indptr[scene_idx+1]]
+        relations = self._edge_relation[edges]
+
+        return self.source[relations], self.target[relations], self._weights(edges)
+
+    def episode_snapshot(self, episode, reduce='mean'):
+        """Network over the scenes of some episode
+        Args:
+        episode (str):        episode id (e.g. 'S01E01')
+        reduce  (str):        aggregation of the weights of every relation over the scenes: 'mean' (over all
+                              the scenes of the episode, 0 where not weighted), 'max' or 'last'
+
+        Returns:
+        source  (np.ndarray): node id of the first speaker of every relation weighted in the episode
+        target  (np.ndarray): node id of the second speaker of these relations
+        weights (np.ndarray): aggregated weight of these relations over the episode
+        """
+
+        if reduce not in ('mean', 'max', 'last'):
+            raise ValueError('Unknown reduction: {}'.format(reduce))
+
+        start, stop = self.episodes[episode]
+        edges = self.scene_edges[self.scene_indptr[start]:self.scene_indptr[stop]]
+
+        # edges of the episode grouped by relation, in scene order
+        relations = self._edge_relation[edges]
+        order = np.argsort(relations, kind='stable')
+        relations, weights = relations[order], self._weights(edges[order])
+
+        if relations.shape[0] == 0:
+            return self.source[:0], self.target[:0], weights
+
+        firsts = np.flatnonzero(np.concatenate([[True], relations[1:] != relations[:-1]]))
+        if reduce == 'mean':
+            weights = np.add.reduceat(weights, firsts) / (stop - start)
+        elif reduce == 'max':
+            weights = np.maximum.reduceat(weights, firsts)
+        else:
+            weights = weights[np.append(firsts[1:], relations.shape[0]) - 1]
+
+        relations = relations[firsts]
+
+        return self.source[relations], self.target[relations], weights
+
+    def top_relations(self, spk, k=10, start=0, stop=None):
+        """Strongest relations of a speaker over a range of scenes
+        Args:
+        spk        (str):  speaker
+        k          (int):  number of relations
+        start      (int):  first scene index (inclusive)
+        stop       (int):  last scene index (exclusive; up to the last scene if None)
+
+        Returns:
+        top        (list): (interlocutor, cumulated weight over the range) of the k strongest relations, strongest first
+        """
+
+        if stop is None:
+            stop = self.S.scene_episode.shape[0]
+
+        node = self._node_idx.get(spk)
+        if node is None:
+            return []
+
+        relations = self._node_relations[self._node_indptr[node]:self._node_indptr[node+1]]
+
+        # cumulated weight of every relation over the range, from the cumulative weights
+        bounds = np.array([self._scene_range(i, start, stop) for i in relations.tolist()], dtype=np.int64).reshape(-1, 2)
+        scores = self._cum_weight[bounds[:, 1]] - self._cum_weight[bounds[:, 0]]
+
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        interlocutors = np.where(self.source[relations] == node, self.target[relations], self.source[relations])
+
+        return [(self.nodes[interlocutors[j]], float(scores[j])) for j in top.tolist()]
+
+    def to_networkx(self, source, target, weights):
+        """Converts a snapshot to a weighted graph
+        Args:
+        source  (np.ndarray): node id of the first speaker of every relation
+        target  (np.ndarray): node id of the second speaker of these relations
+        weights (np.ndarray): weight of these relations
+
+        Returns:
+        G       (nx.Graph):   undirected, weighted graph
+        """
+
+        import networkx as nx
+
+        G = nx.Graph()
+        G.add_weighted_edges_from((self.nodes[f], self.nodes[s], w)
+                                  for f, s, w in zip(source.tolist(), target.tolist(), weights.tolist()))
+
+        return G
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import numpy as np
+
 
 def assign_speech_turns_to_scenes(scenes, speech_turns, duration):
     """Assigns every speech turn to the most overlapping scene
@@ -43,6 +45,55 @@ def assign_speech_turns_to_scenes(scenes, speech_turns, duration):
     return scene_speech_turns
 
 
+def assign_speech_turns_to_scene_offsets(scene_starts, duration, seg_starts, seg_ends):
+    """Assigns every speech turn to the most overlapping scene, as assign_speech_turns_to_scenes, with array operations
+    Args:
+    scene_starts (np.ndarray): starting points of the scenes
+    duration     (float):      episode duration
+    seg_starts   (np.ndarray): starting points of the speech turns, in chronological order
+    seg_ends     (np.ndarray): ending points of the speech turns
+
+    Returns:
+    offsets      (np.ndarray): offsets of every scene into the speech turns, shape (n_scenes+1,): speech turns
+                               offsets[i]:offsets[i+1] belong to the i-th scene, speech turns past offsets[-1] to no scene
+                               (in which case, as with assign_speech_turns_to_scenes, an extra empty scene is added)
+    """
+
+    scene_starts = np.asarray(scene_starts, dtype=np.float64)
+    seg_starts = np.asarray(seg_starts, dtype=np.float64)
+    seg_ends = np.asarray(seg_ends, dtype=np.float64)
+    n_scenes = scene_starts.shape[0]
+
+    # (exclusive) scene ending points
+    scene_ends = np.append(scene_starts[1:], duration)
+
+    def overlaps(i):
+        # the speech turn ends in scene i or after, and mostly before the end of scene i
+        return (scene_ends[np.minimum(i, n_scenes - 1)] - seg_starts) > (seg_ends - seg_starts) / 2
+
+    # first scene ending after the middle of each speech turn
+    scene_idx = np.searchsorted(scene_ends, (seg_starts + seg_ends) / 2, side='right')
+
+    # settle ties at scene boundaries exactly as the sequential assignment
+    while True:
+        back = (scene_idx > 0) & overlaps(scene_idx - 1)
+        forward = (scene_idx < n_scenes) & ~overlaps(scene_idx) & ~back
+        if not (np.any(back) or np.any(forward)):
+            break
+        scene_idx = scene_idx - back + forward
+
+    # scenes are never revisited
+    scene_idx = np.maximum.accumulate(scene_idx)
+
+    offsets = np.searchsorted(scene_idx, np.arange(n_scenes + 1), side='left')
+
+    # speech turns ending past the last scene are left out, in an extra empty scene
+    if offsets[-1] < seg_starts.shape[0]:
+        offsets = np.append(offsets, offsets[-1])
+
+    return offsets
+
+
 def speech_turns_to_speaker_turns(speech_turns):
     """Merges speech turns into speaker turns
     Args: